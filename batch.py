@@ -0,0 +1,76 @@
+"""Differentiate, simplify and evaluate many expressions across a process pool.
+
+Expressions travel to and from the workers as store.dumps() bytes rather than pickled
+object graphs, in chunks, and results come back in input order. Workers rebuild the
+composites defined in compositions; composites defined elsewhere must be created at
+import time of a module the workers import (or the pool must fork, the Linux default).
+"""
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from modules import *
+from compositions import *
+import store
+
+
+def _derive(payload: bytes, order: int, simplify: bool) -> Expression:
+    expr = store.loads(payload)
+    if order:
+        return nth_derivative(expr, order, simplify)
+    return expr.simplify() if simplify else expr
+
+
+def _differentiate_chunk(order: int, simplify: bool, chunk: list) -> list:
+    return [store.dumps(_derive(payload, order, simplify)) for payload in chunk]
+
+
+def _evaluate_chunk(order: int, simplify: bool, chunk: list) -> list:
+    return [_derive(payload, order, simplify).evaluate(points) for payload, points in chunk]
+
+
+def _chunks(items: list, chunksize: int) -> list:
+    return [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+
+
+def _map(fn, items: list, processes: int, chunksize: int, *args) -> list:
+    processes = processes or os.cpu_count() or 1
+    if not chunksize:
+        # a few chunks per worker evens out uneven expression sizes
+        chunksize = max(1, -(-len(items) // (processes * 4)))
+    chunks = _chunks(items, chunksize)
+    fn = functools.partial(fn, *args)
+    if processes == 1 or len(chunks) == 1:
+        results = [fn(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(fn, chunks)) # map keeps the input order
+    return [result for chunk in results for result in chunk]
+
+
+def differentiate(exprs: list, order: int = 1, simplify: bool = True, processes: int = None,
+                  chunksize: int = None) -> list:
+    """The order-th derivative of every expression, simplified unless simplify=False.
+
+    order=0 just simplifies. processes defaults to the number of cores.
+    """
+    payloads = [store.dumps(expr) for expr in exprs]
+    return [store.loads(result) for result in _map(_differentiate_chunk, payloads, processes, chunksize,
+                                                    order, simplify)]
+
+
+def evaluate(exprs: list, points, order: int = 0, simplify: bool = True, processes: int = None,
+             chunksize: int = None) -> list:
+    """Each expression's order-th derivative evaluated at points.
+
+    points is one array shared by every expression or a list with one array per
+    expression; results are arrays in the same order as exprs.
+    """
+    if isinstance(points, list) and len(points) == len(exprs) and all(np.ndim(p) for p in points):
+        grids = [np.asarray(p, dtype=float) for p in points]
+    else:
+        grids = [np.asarray(points, dtype=float)] * len(exprs)
+    items = [(store.dumps(expr), grid) for expr, grid in zip(exprs, grids)]
+    return _map(_evaluate_chunk, items, processes, chunksize, order, simplify)
@@ -0,0 +1,242 @@
+"""Benchmarks for derivative growth, simplify cost and evaluation throughput.
+
+    python bench.py [--orders 4] [--points 100000] [--output bench_output.txt]
+
+Every result is written as one JSON object per line, so runs from different versions
+can be diffed or loaded side by side to catch regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from modules import *
+from extra import *
+from compositions import *
+from nn import Parameter, Tensor, Tape, Linear, MSELoss
+from train import Trainer, SGD
+from instrument import shape
+
+CORPUS = {
+    "tan": lambda: Tan(X()),
+    "sec": lambda: Sec(X()),
+    "csc": lambda: Csc(X()),
+    "cot": lambda: Cot(X()),
+    "log10": lambda: Log10(X()),
+    "square_of_sin": lambda: Square(Sin(X())),
+    "nested_ftotheg": lambda: FToTheG(X(), FToTheG(X(), Add(X(), Constant(1)))),
+    "polynomial_chain": lambda: PolynomialExponent(Constant(3), Add(PolynomialExponent(Constant(2), X()), Multiply(Constant(3), X()))),
+    "exp_sin_product": lambda: Multiply(EToTheF(Multiply(Constant(2), X())), Sin(PolynomialExponent(Constant(2), X()))),
+}
+
+# every corpus function is defined (and away from its poles) on this interval
+DOMAIN = (0.1, 1.2)
+
+
+def timed(fn, min_time: float = 0.2):
+    """Average seconds per call of fn, repeating until at least min_time has passed."""
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def bench_expression(name: str, build, orders: int, points: int):
+    xs = np.linspace(*DOMAIN, points)
+    scalar_xs = [float(x) for x in np.linspace(*DOMAIN, 50)]
+    expr = build()
+    for order in range(orders + 1):
+        if order:
+            # timed under tracemalloc: interning means a second build would allocate nothing
+            tracemalloc.start()
+            start = time.perf_counter()
+            expr = expr.derivative()
+            derivative_s = time.perf_counter() - start
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            derivative_s, peak_bytes = 0.0, 0
+        nodes, tree_size, depth = shape(expr)
+
+        start = time.perf_counter()
+        simplified = expr.simplify()
+        simplify_s = time.perf_counter() - start
+
+        compiled = expr.compile()
+        scalar_s = timed(lambda: [expr(x) for x in scalar_xs]) / len(scalar_xs)
+        compiled_s = timed(lambda: [compiled(x) for x in scalar_xs]) / len(scalar_xs)
+        batch_s = timed(lambda: expr.evaluate(xs))
+        yield {
+            "benchmark": "expression",
+            "name": name,
+            "order": order,
+            "nodes": nodes,
+            "tree_size": tree_size,
+            "depth": depth,
+            "simplified_nodes": shape(simplified)[0],
+            "derivative_s": derivative_s,
+            "derivative_peak_bytes": peak_bytes,
+            "simplify_s": simplify_s,
+            "scalar_evals_per_s": 1 / scalar_s,
+            "compiled_evals_per_s": 1 / compiled_s,
+            "batch_points_per_s": points / batch_s,
+        }
+
+
+def bench_training(samples: int = 10000, features: int = 8, steps: int = 20):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(samples, features))
+    y = x @ rng.normal(size=(features, 1)) + 0.5
+    model = Linear(Tensor(np.zeros((features, 1))), Tensor(np.zeros(1)))
+
+    forward_s = backward_s = 0.0
+    for _ in range(steps):
+        start = time.perf_counter()
+        loss = MSELoss(model, y)(x)
+        forward_s += time.perf_counter() - start
+        start = time.perf_counter()
+        loss.backward()
+        backward_s += time.perf_counter() - start
+        for p in (model.weight, model.bias):
+            p.value -= 0.1 * p._grad
+            p.zero_grad()
+    # peak memory from one more pass, so tracing doesn't slow down the timed ones
+    tracemalloc.start()
+    MSELoss(model, y)(x).backward()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    yield {
+        "benchmark": "training",
+        "name": "tensor_linear",
+        "samples": samples,
+        "features": features,
+        "forward_s": forward_s / steps,
+        "backward_s": backward_s / steps,
+        "samples_per_s": samples * steps / (forward_s + backward_s),
+        "peak_bytes": peak_bytes,
+        "final_loss": float(loss.value),
+    }
+
+    # mini-batches through Trainer, reusing one graph per batch shape
+    model = Linear(Tensor(np.zeros((features, 1))), Tensor(np.zeros(1)))
+    trainer = Trainer(model, SGD(model.parameters(), 0.1), batch_size=1000)
+    trainer.fit(x, y) # builds the graphs
+    tracemalloc.start()
+    history = trainer.fit(x, y, epochs=steps // 10 or 1, seed=0)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = sum(step["seconds"] for step in history)
+    yield {
+        "benchmark": "training",
+        "name": "trainer_sgd",
+        "samples": samples,
+        "features": features,
+        "batch_size": trainer.batch_size,
+        "step_s": seconds / len(history),
+        "samples_per_s": sum(step["samples"] for step in history) / seconds,
+        "peak_bytes": peak_bytes,
+        "final_loss": history[-1]["loss"],
+    }
+
+    # the same fit with one scalar Parameter graph per sample
+    n = min(samples, 2000)
+    w, b = Parameter(0.0), Parameter(0.0)
+    tracemalloc.start()
+    start = time.perf_counter()
+    total = Parameter(0.0)
+    for xi, yi in zip(x[:n, 0], y[:n, 0]):
+        total = total + (w * Parameter(float(xi)) + b - Parameter(float(yi))) ** 2
+    forward_s = time.perf_counter() - start
+    start = time.perf_counter()
+    total.backward()
+    backward_s = time.perf_counter() - start
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    yield {
+        "benchmark": "training",
+        "name": "parameter_linear",
+        "samples": n,
+        "features": 1,
+        "forward_s": forward_s,
+        "backward_s": backward_s,
+        "samples_per_s": n / (forward_s + backward_s),
+        "peak_bytes": peak_bytes,
+        "graph_nodes": len(total.topological_order()),
+    }
+
+    # and recorded on a Tape, whose memory is reused for a second pass
+    tape = Tape()
+    w, b = tape.leaf(0.0), tape.leaf(0.0)
+    start_row = len(tape)
+    for _ in range(2): # the first pass grows the tape, the second reuses it
+        tape.reset(start_row)
+        tracemalloc.start()
+        start = time.perf_counter()
+        total = tape.leaf(0.0)
+        for xi, yi in zip(x[:n, 0].tolist(), y[:n, 0].tolist()):
+            err = tape.sub(tape.add(tape.mul(w, tape.leaf(xi)), b), tape.leaf(yi))
+            total = tape.add(total, tape.mul(err, err))
+        forward_s = time.perf_counter() - start
+        start = time.perf_counter()
+        tape.backward(total)
+        backward_s = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    yield {
+        "benchmark": "training",
+        "name": "tape_linear",
+        "samples": n,
+        "features": 1,
+        "forward_s": forward_s,
+        "backward_s": backward_s,
+        "samples_per_s": n / (forward_s + backward_s),
+        "peak_bytes": peak_bytes,
+        "graph_nodes": len(tape),
+    }
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"benchmark": "meta", "commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=4, help="highest derivative order to build")
+    parser.add_argument("--points", type=int, default=100000, help="points per batch evaluation")
+    parser.add_argument("--only", nargs="*", choices=sorted(CORPUS) + ["training"], help="subset to run")
+    parser.add_argument("--output", default="bench_output.txt", help="JSON lines output file")
+    args = parser.parse_args(argv)
+
+    with open(args.output, "w") as out:
+        def record(result):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            summary = {k: (f"{v:.3g}" if isinstance(v, float) else v) for k, v in result.items()}
+            print(" ".join(f"{k}={v}" for k, v in summary.items()), file=sys.stderr)
+
+        record(metadata())
+        for name, build in CORPUS.items():
+            if not args.only or name in args.only:
+                for result in bench_expression(name, build, args.orders, args.points):
+                    record(result)
+        if not args.only or "training" in args.only:
+            for result in bench_training():
+                record(result)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,36 @@
+import math
+import numpy as np
+
 from modules import *
 from extra import *
 
 
-
-Tan = Composite.fromFunctional(Divide(Sin(X),Cos(X)), "Tan")
-Cot = Composite.fromFunctional(Divide(Cos(X),Sin(X)), "Cot")
-Sec = Composite.fromFunctional(Divide(Constant(1),Cos(X)), "Sec")
-Csc = Composite.fromFunctional(Divide(Constant(1),Sin(X)), "Csc")
-
-
-Inverse = Composite.fromFunctional(Divide(Constant(1),X), "Inverse")
-Square = Composite.fromFunctional(Multiply(X(),X()), "Inverse")
-
-Log10 = Composite.fromFunctional(Divide(Ln(X),Constant(Ln(Constant(10))(Constant(0)))), "Log10")
+# Each composite's derivative is given in closed form, in Sin/Cos so it doesn't refer back
+# to the composites themselves, and its kernel evaluates it in one NumPy call.
+Tan = Composite.fromFunctional(Divide(Sin(X),Cos(X)), "Tan",
+                               derivative=Divide(Constant(1), PolynomialExponent(Constant(2), Cos(X))), # sec^2
+                               kernel=np.tan)
+Cot = Composite.fromFunctional(Divide(Cos(X),Sin(X)), "Cot",
+                               derivative=Divide(Constant(-1), PolynomialExponent(Constant(2), Sin(X))), # -csc^2
+                               kernel=lambda x: np.cos(x) / np.sin(x))
+Sec = Composite.fromFunctional(Divide(Constant(1),Cos(X)), "Sec",
+                               derivative=Divide(Sin(X), PolynomialExponent(Constant(2), Cos(X))), # sec tan
+                               kernel=lambda x: 1 / np.cos(x))
+Csc = Composite.fromFunctional(Divide(Constant(1),Sin(X)), "Csc",
+                               derivative=Divide(Multiply(Constant(-1), Cos(X)), PolynomialExponent(Constant(2), Sin(X))), # -csc cot
+                               kernel=lambda x: 1 / np.sin(x))
+
+
+Inverse = Composite.fromFunctional(Divide(Constant(1),X), "Inverse",
+                                   derivative=Multiply(Constant(-1), PolynomialExponent(Constant(-2), X)),
+                                   kernel=lambda x: 1 / x)
+Square = Composite.fromFunctional(Multiply(X(),X()), "Square",
+                                  derivative=Multiply(Constant(2), X),
+                                  kernel=np.square)
+
+Log10 = Composite.fromFunctional(Divide(Ln(X),Constant(Ln(Constant(10))(Constant(0)))), "Log10",
+                                 derivative=Divide(Constant(1), Multiply(Constant(math.log(10)), X)),
+                                 kernel=np.log10)
 
 if __name__ == "__main__":
     expr = Tan(X())
@@ -21,4 +39,4 @@ if __name__ == "__main__":
 
     print(expr.derivative()(1))
 
-    print(expr.derivative().simplify()) # messy bc derived from quotient rule
+    print(expr.derivative().simplify()) # sec^2, from the closed form
@@ -1,90 +1,141 @@
 from modules import *
+from modules import _node, _as_polynomial, _constant_value
 import math
 
 
+def _base(expr: Expression) -> str:
+    # -2 ^ x reads as -(2 ^ x), so a negative constant base is printed as (-2)
+    text = repr(expr)
+    return f"({text})" if isinstance(expr, Constant) and text.startswith("-") else text
+
 
 class PolynomialExponent(Expression):
+    _fields = ("exponent", "baseExpression")
+    __slots__ = _fields
+
     def __init__(self, exponent: Constant, baseExpression: Expression = X) -> None:
         super().__init__()
 
 
         self.exponent = exponent
-        self.baseExpression = baseExpression
+        self.baseExpression = _node(baseExpression)
 
     def __call__(self, x: float) -> float:
         return  self.baseExpression(x) ** self.exponent.k
+
+    def _lower(self, prog, x):
+        return prog.emit("pow", prog.lower(self.baseExpression, x), prog.const(self.exponent.k))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(self.exponent, Multiply(self.baseExpression.derivative(), PolynomialExponent(self.exponent - Constant(1), self.baseExpression)))
     
     def __repr__(self):
-        return f"({self.baseExpression.__repr__()} ^ {self.exponent.__repr__()})"
+        return f"({_base(self.baseExpression)} ^ {self.exponent.__repr__()})"
     
 
-    def simplify(self):
-        self.baseExpression = self.baseExpression.simplify()
+    def _rewrite(self):
         if isinstance(self.baseExpression, Constant):
-            return Constant(self.baseExpression ** self.exponent).simplify()
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
 
-        return PolynomialExponent(self.exponent, self.baseExpression.simplify())
+        if self.exponent.k == 1.0: # b ^ 1
+            return self.baseExpression
+
+        p = _as_polynomial(self.baseExpression)
+        k = self.exponent.k
+        if p is not None and isinstance(k, (int, float)) and 0 <= k < math.inf and k == int(k) \
+                and (len(p.terms) == 1 or p.degree * k <= 1024): # don't expand (x + 1) ^ 10**6
+            return p ** int(k)
+
+        return self
+
+    def _fold(self):
+        if self.exponent.k == 1: # b ^ 1
+            return self.baseExpression
+        if self.exponent.k == 0: # b ^ 0 is 1 even for b = 0, inf or nan
+            return Constant(1.0)
+        return self
     
 class EToTheF(Expression):
+    _fields = ("f",)
+    __slots__ = _fields
+
     def __init__(self, f: Expression = X) -> None:
         super().__init__()
 
-        self.f = f
+        self.f = _node(f)
 
     def __call__(self, x: float) -> float:
         return math.exp(self.f(x))
+
+    def _lower(self, prog, x):
+        return prog.emit("exp", prog.lower(self.f, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(self.f.derivative(), self)
     
     def __repr__(self):
-        return f"e^{self.f}"
+        return f"(e^{self.f})"
     
-    def simplify(self):
-        if isinstance(self.f, Constant) :
-            return Constant(math.e ** self.exponent).simplify()
+    def _rewrite(self):
+        if isinstance(self.f, Constant):
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
 
-        return EToTheF(self.f.simplify())
+        return self
 class Ln(Expression):
+    _fields = ("f",)
+    __slots__ = _fields
+
     def __init__(self, f: Expression = X) -> None:
         super().__init__()
 
-        self.f = f
+        self.f = _node(f)
 
     def __call__(self, x: float) -> float:
         return math.log(self.f(x))
+
+    def _lower(self, prog, x):
+        return prog.emit("log", prog.lower(self.f, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(Divide(Constant(1),self.f), self.f.derivative())
     
     def __repr__(self):
         return f"ln({self.f})"
     
-    def simplify(self):
-        if isinstance(self.f, Constant) :
-            return Constant(math.log(self.f.k)).simplify()
+    def _rewrite(self):
+        if isinstance(self.f, Constant):
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
 
-        return Ln(self.f.simplify())
+        return self
 
 
 class FToTheG(Expression):
+    _fields = ("f", "g")
+    __slots__ = _fields
+
     def __init__(self, f: Expression = X, g: Expression = X) -> None:
         super().__init__()
 
-        self.f = f
-        self.g = g
+        self.f = _node(f)
+        self.g = _node(g)
 
     def __call__(self, x: float) -> float:
         return self.f(x) ** self.g(x)
+
+    def _lower(self, prog, x):
+        return prog.emit("pow", prog.lower(self.f, x), prog.lower(self.g, x))
     
     #https://www.wolframalpha.com/input?i=derivative+f%28x%29%5Eg%28x%29
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         f_deriv = self.f.derivative()
         g_deriv = self.g.derivative()
         
@@ -94,58 +145,79 @@ class FToTheG(Expression):
         inner_derivative = Add(first_term, second_term)  # g(x) f'(x) + f(x) log(f(x)) g'(x)
         
         # Outer derivative part is f(x)^(g(x) - 1)
-        outer_derivative = FToTheG(Subtract(self.g, Constant(1)), self.f)
+        outer_derivative = FToTheG(self.f, Subtract(self.g, Constant(1)))
         
         # Full derivative: f(x)^(g(x) - 1) * (g(x) f'(x) + f(x) log(f(x)) g'(x))
         return Multiply(outer_derivative, inner_derivative)
     
     def __repr__(self):
-        return f"{self.f} of ({self.g} of (x))"
+        return f"({_base(self.f)} ^ {self.g})"
     
-    def simplify(self):
+    def _rewrite(self):
+        if isinstance(self.f, Constant) and isinstance(self.g, Constant):
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
+
         return self
    
 
 class Sin(Expression):
+    _fields = ("f",)
+    __slots__ = _fields
+
     def __init__(self, f: Expression = X) -> None:
         super().__init__()
 
-        self.f = f
+        self.f = _node(f)
 
     def __call__(self, x: float) -> float:
-        return math.sin(x)
+        return math.sin(self.f(x))
+
+    def _lower(self, prog, x):
+        return prog.emit("sin", prog.lower(self.f, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(Cos(self.f), self.f.derivative())
     
     def __repr__(self):
         return f"sin({self.f})"
     
-    def simplify(self):
-        if isinstance(self.f, Constant) :
-            return Constant(math.sin(self.f.k)).simplify()
+    def _rewrite(self):
+        if isinstance(self.f, Constant):
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
 
-        return Sin(self.f.simplify())
+        return self
     
 class Cos(Expression):
+    _fields = ("f",)
+    __slots__ = _fields
+
     def __init__(self, f: Expression = X) -> None:
         super().__init__()
 
-        self.f = f
+        self.f = _node(f)
 
     def __call__(self, x: float) -> float:
-        return math.cos(x)
+        return math.cos(self.f(x))
+
+    def _lower(self, prog, x):
+        return prog.emit("cos", prog.lower(self.f, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(Multiply(Constant(-1.0), Sin(self.f)), self.f.derivative())
     
     def __repr__(self):
         return f"cos({self.f})"
     
-    def simplify(self):
-        if isinstance(self.f, Constant) :
-            return Constant(math.cos(self.f.k)).simplify()
+    def _rewrite(self):
+        if isinstance(self.f, Constant):
+            value = _constant_value(self)
+            if value is not None: # left alone if it isn't a finite real
+                return Constant(value)
 
-        return Cos(self.f.simplify())
\ No newline at end of file
+        return self
\ No newline at end of file
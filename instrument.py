@@ -0,0 +1,185 @@
+"""Opt-in instrumentation for expression DAGs and autograd graphs.
+
+    stats = ExpressionStats(expr)          # node counts per type, depth, sharing
+    graph = GraphStats(loss)               # the same for a Parameter or Tensor graph
+    with Profile() as profile:             # time per node class while the block runs
+        expr.derivative().simplify()(0.5)
+    print(profile.as_dict())
+
+Profile works by wrapping the methods it times when the block is entered and putting
+the originals back when it exits, so there is no cost at all outside a block.
+"""
+import time
+import types
+import weakref
+from collections import Counter
+
+from modules import *
+from nn import Parameter, Tensor
+
+
+def _walk(expr: Expression):
+    # post-order over the distinct nodes of a DAG, without recursion
+    seen = set()
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in seen:
+            stack.pop()
+            continue
+        children = node._children()
+        pending = [child for child in children if id(child) not in seen]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        seen.add(id(node))
+        yield node, children
+
+
+def shape(expr: Expression):
+    """(distinct nodes, nodes if expanded as a tree, depth) of an expression DAG."""
+    tree_size, depth = {}, {}
+    for node, children in _walk(expr):
+        tree_size[id(node)] = 1 + sum(tree_size[id(child)] for child in children)
+        depth[id(node)] = 1 + max((depth[id(child)] for child in children), default=0)
+    return len(tree_size), tree_size[id(expr)], depth[id(expr)]
+
+
+class ExpressionStats:
+    """The shape of an expression DAG.
+
+    shared_ratio is the fraction of the fully expanded tree that is a repeat of a shared
+    subtree: 0 for a tree with no sharing, close to 1 when a few nodes are reused a lot.
+    """
+
+    def __init__(self, expr: Expression) -> None:
+        self.nodes, self.tree_size, self.depth = shape(expr)
+        self.node_types = Counter(type(node).__name__ for node, _ in _walk(expr))
+
+    @property
+    def shared_ratio(self) -> float:
+        return 1 - self.nodes / self.tree_size
+
+    def as_dict(self) -> dict:
+        return {"nodes": self.nodes, "tree_size": self.tree_size, "depth": self.depth,
+                "shared_ratio": self.shared_ratio, "node_types": dict(self.node_types)}
+
+    def __repr__(self) -> str:
+        return f"ExpressionStats({self.as_dict()})"
+
+
+class GraphStats:
+    """Node count, leaves, ops and depth of the Parameter or Tensor graph ending at root."""
+
+    def __init__(self, root) -> None:
+        order = root.topological_order()
+        self.nodes = len(order)
+        self.leaves = sum(1 for node in order if not node._parents)
+        self.ops = Counter(node._op for node in order if node._op is not None)
+        depth = {}
+        for node in reversed(order): # parents before the nodes built from them
+            depth[id(node)] = 1 + max((depth[id(parent)] for parent, _ in node._parents), default=0)
+        self.depth = depth[id(root)]
+
+    def as_dict(self) -> dict:
+        return {"nodes": self.nodes, "leaves": self.leaves, "depth": self.depth, "ops": dict(self.ops)}
+
+    def __repr__(self) -> str:
+        return f"GraphStats({self.as_dict()})"
+
+
+def _expression_classes():
+    classes, stack = [], [Expression]
+    while stack:
+        cls = stack.pop()
+        classes.append(cls)
+        stack.extend(cls.__subclasses__())
+    return classes
+
+
+class Profile:
+    """Call counts and self time per (node class, method) while the with block runs.
+
+    Methods are __call__, derivative (including derivative_cache hits) and simplify (the
+    per-node rewrite step); self time excludes time spent in nested timed calls, so the
+    numbers add up. Parameter and Tensor backward() calls are timed as well, and
+    peak_live is the most Parameter and Tensor objects alive at once during the block.
+    """
+
+    _active = None
+
+    def __init__(self) -> None:
+        self.calls = Counter()    # (class name, method) -> calls
+        self.seconds = Counter()  # (class name, method) -> self time
+        self.live = 0
+        self.peak_live = 0
+        self._stack = []          # time spent in nested timed calls, per open call
+        self._patched = []        # (owner, attribute, original), to undo on exit
+
+    def _timed(self, fn, method: str):
+        stack, calls, seconds = self._stack, self.calls, self.seconds
+
+        def timed(node, *args, **kwargs):
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return fn(node, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                key = (type(node).__name__, method)
+                calls[key] += 1
+                seconds[key] += elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+        return timed
+
+    def _counted(self, init):
+        profile = self
+
+        def counted(node, *args, **kwargs):
+            init(node, *args, **kwargs)
+            profile.live += 1
+            profile.peak_live = max(profile.peak_live, profile.live)
+            weakref.finalize(node, profile._died)
+        return counted
+
+    def _died(self) -> None:
+        self.live -= 1
+
+    def _patch(self, owner, attribute: str, wrap) -> None:
+        original = owner.__dict__[attribute]
+        self._patched.append((owner, attribute, original))
+        setattr(owner, attribute, wrap(original))
+
+    def __enter__(self) -> "Profile":
+        if Profile._active is not None:
+            raise RuntimeError("a Profile is already active")
+        Profile._active = self
+        for cls in _expression_classes():
+            for attribute, method in (("__call__", "__call__"), ("derivative", "derivative"),
+                                      ("_rewrite", "simplify")):
+                if isinstance(cls.__dict__.get(attribute), types.FunctionType):
+                    self._patch(cls, attribute, lambda fn, method=method: self._timed(fn, method))
+        for cls in (Parameter, Tensor):
+            self._patch(cls, "backward", lambda fn: self._timed(fn, "backward"))
+            self._patch(cls, "__init__", self._counted)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for owner, attribute, original in reversed(self._patched):
+            setattr(owner, attribute, original)
+        self._patched.clear()
+        Profile._active = None
+
+    def as_dict(self) -> dict:
+        """{class name: {method: {"calls": n, "seconds": self time}}, ..., "peak_live": n}"""
+        report = {}
+        for (name, method), calls in sorted(self.calls.items()):
+            report.setdefault(name, {})[method] = {"calls": calls, "seconds": self.seconds[(name, method)]}
+        report["peak_live"] = self.peak_live
+        return report
+
+    def slowest(self, n: int = 10) -> list:
+        """The n (class name, method, self seconds) entries with the most self time."""
+        return [(name, method, seconds) for (name, method), seconds in self.seconds.most_common(n)]
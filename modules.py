@@ -1,18 +1,197 @@
 from typing import Type, Callable
+from collections import OrderedDict
+import functools
+import keyword
 import math
+import threading
+import weakref
+import numpy as np
+from program import Program, Incremental
+
+def _node(expr):
+    # Sin(X) and friends pass the X class itself; use an instance so it can be called
+    return expr() if isinstance(expr, type) else expr
+
+# Hash-consing table: structurally identical nodes are the same object, so derivative()
+# and simplify() output is a DAG. Keys hold the child nodes themselves (hashed and compared
+# by identity) rather than id() ints, which would cost an extra int object per child; the
+# entry, and with it the key, goes away when the interned node dies.
+_interned = weakref.WeakValueDictionary()
+
+def _intern_key(arg):
+    if isinstance(arg, (Expression, type)):
+        return _node(arg)
+    if isinstance(arg, (float, np.floating)) and arg == 0.0: # 0.0 == -0.0 but 1/0.0 != 1/-0.0
+        return (type(arg), arg, math.copysign(1.0, arg))
+    return (type(arg), arg)
+
+# ids of nodes __new__ has made but whose __init__ hasn't run yet; every other node a
+# constructor returns is an interned one, already built, whose fields are left alone
+_unbuilt = set()
+
+def _build_once(init):
+    # wraps each node class's __init__ so it only runs on a node __new__ just made
+    @functools.wraps(init)
+    def __init__(self, *args, **kwargs):
+        if type(self).__init__ is not __init__: # a subclass's __init__ calling super().__init__
+            return init(self, *args, **kwargs)
+        if id(self) not in _unbuilt:
+            return
+        try:
+            init(self, *args, **kwargs)
+        finally:
+            _unbuilt.discard(id(self))
+    return __init__
+
+# name -> class for every composite made by Composite.fromFunctional
+composites = {}
+
+def _composite(name, inner_expr):
+    # unpickles a fromFunctional node, whose class only exists once fromFunctional has run
+    return composites[name](inner_expr)
+
+def _coefficient(name, value):
+    # unpickles or loads a Coefficient: a live one keeps its own value, only a new one takes value
+    node = _interned.get((Coefficient, _intern_key(name)))
+    return node if node is not None else Coefficient(name, value)
+
+# set while a Derivative expands, so derivative() of its children stays lazy
+_lazy = threading.local()
 
 class Expression:
+    _fields = () # names of the child Expression attributes, in constructor order
+    __slots__ = ("__weakref__",) # nodes are small and numerous; no per-instance __dict__
+
+    def __new__(cls, *args, **kwargs):
+        key = (cls, *map(_intern_key, args), *((k, _intern_key(v)) for k, v in sorted(kwargs.items())))
+        try:
+            node = _interned.get(key)
+        except TypeError: # unhashable argument, can't be shared
+            node = super().__new__(cls)
+            _unbuilt.add(id(node))
+            return node
+        if node is None:
+            node = super().__new__(cls)
+            _interned[key] = node
+            _unbuilt.add(id(node))
+        return node
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "__init__" in cls.__dict__:
+            cls.__init__ = _build_once(cls.__dict__["__init__"])
+
     def __init__(self) -> None:
         pass
 
+    def __reduce__(self):
+        # copy and pickle rebuild through the constructor, so they get the interned node
+        # instead of calling cls.__new__(cls) and overwriting the shared one
+        return type(self), self._args()
+
+    def _args(self) -> tuple:
+        # the constructor arguments that rebuild this node
+        return self._children()
+
     def __call__(self,x: float) -> float:
         return 0.0
+
+    def evaluate(self, x, **variables) -> np.ndarray:
+        """Evaluate over a whole array of points, computing each distinct subexpression once.
+
+        Values for any Variables in the expression are passed by name.
+        """
+        x = np.asarray(x, dtype=float)
+        out = _lowered(self).run(x, {name: np.asarray(v, dtype=float) for name, v in variables.items()})
+        if out is x or not isinstance(out, np.ndarray) or out.shape != x.shape:
+            out = np.array(np.broadcast_to(out, x.shape))
+        return out
+
+    def value_and_derivative(self, x, **variables):
+        """(f(x), f'(x)) from one forward-mode pass, without building derivative().
+
+        x can be a float or an array of points. Values for any Variables are passed by
+        name and held constant.
+        """
+        x, env = _split_point({**variables, "x": x})
+        if not isinstance(x, np.ndarray):
+            value, slope = _lowered(self).run_dual(x, env)
+            return value, 0.0 if slope is None else slope
+        value, slope = _lowered(self).run_dual(x, env)
+        shape = np.broadcast_shapes(x.shape, *(np.shape(v) for v in env.values()))
+        return (np.array(np.broadcast_to(value, shape)),
+                np.zeros(shape) if slope is None else np.array(np.broadcast_to(slope, shape)))
+
+    def derivatives(self, x, order: int, **variables) -> np.ndarray:
+        """[f(x), f'(x), ..., f^(order)(x)] by Taylor-mode arithmetic, without derivative().
+
+        Costs O(order^2) per node rather than growing with every symbolic derivative. x and
+        any Variables' values can be floats or arrays, giving a result of shape
+        (order + 1, *batch shape).
+        """
+        x = float(x) if np.ndim(x) == 0 else np.asarray(x, dtype=float)
+        coefficients = _lowered(self).run_taylor(x, order, {name: np.asarray(v, dtype=float)
+                                                           for name, v in variables.items()})
+        factorials = np.array([math.factorial(n) for n in range(order + 1)], dtype=float)
+        return coefficients * factorials.reshape((-1,) + (1,) * (coefficients.ndim - 1))
+
+    def value_and_gradient(self, point: dict):
+        """(f, {name: df/dname}) at a point mapping "x" and Variable names to values.
+
+        One forward and one reverse sweep give every partial derivative at once; values
+        may be arrays to get the gradient at a batch of points.
+        """
+        x, env = _split_point(point)
+        return _lowered(self).gradients(x, env)[0]
+
+    def compile(self) -> Callable[[float], float]:
+        """Lower the tree once into a plain straight-line f(x) function."""
+        return _lowered(self).compile()
+
+    def incremental(self, x, **variables) -> Incremental:
+        """This expression's value at x, kept up to date as its Coefficients change.
+
+        After a coefficient is set, value() recomputes only what depends on it.
+        """
+        return Incremental(_lowered(self), x, variables)
+
+    def _lower(self, prog: Program, x: int) -> int:
+        return prog.emit("call", x, value=self)
     
     def derivative(self):
+        """d/dx of this expression, cached so a shared subtree is only differentiated once."""
+        d = derivative_cache.get(self)
+        if d is None:
+            if self._fields and getattr(_lazy, "active", False):
+                return Derivative(self) # expanding a Derivative: leave the children's for later
+            d = fold(self._derivative())
+            derivative_cache[self] = d
+        return d
+
+    def _derivative(self):
         return Expression()
     
     def simplify(self):
+        return simplify(self)
+
+    def fold(self):
+        return fold(self)
+
+    def _rewrite(self):
+        # one local simplification step, assuming the children are already simplified
         return self
+
+    def _fold(self):
+        # exact identities and constant reassociation, assuming the children are folded
+        return self
+
+    def _children(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def _rebuild(self, children):
+        if all(new is old for new, old in zip(children, self._children())):
+            return self
+        return type(self)(*children)
     
     def __repr__(self):
         return "Expression"
@@ -22,87 +201,304 @@ class Expression:
     
     
 class Composite(Expression):
+    _fields = ("f", "g")
+    __slots__ = _fields
+
     def __init__(self,f,g) -> None:
         super().__init__()
 
-        self.f = f
-        self.g = g
+        self.f = _node(f)
+        self.g = _node(g)
 
     def __call__(self, x: float) -> float:
         return self.f(self.g(x))
+
+    def _lower(self, prog, x):
+        return prog.lower(self.f, prog.lower(self.g, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Multiply(Composite(self.f.derivative(),self.g),self.g.derivative())
     
     def __repr__(self):
         return f"[({self.f.__repr__()}) of ({self.g.__repr__()})]"
     
-    def simplify(self):
-        return self
-    
     @classmethod
-    def fromFunctional(cls, func: Expression, name: str = "CompositeExpression") -> Type["Expression"]:
+    def fromFunctional(cls, func: Expression, name: str = "CompositeExpression",
+                       derivative: Expression = None, kernel: Callable = None) -> Type["Expression"]:
+        """A node class computing func (an expression in X) of its one argument.
+
+        The argument is substituted into func once per node, so evaluating and lowering
+        don't go through an extra Composite. derivative, also in X, is func's closed-form
+        derivative (func.derivative() if not given), and kernel a NumPy function computing
+        func directly, used by __call__, evaluate() and compile() in place of func's tree.
+        """
         class CompositeExpression(Expression):
+            _fields = ("inner_expr",)
+            __slots__ = ("inner_expr", "body")
+
             def __init__(self, inner_expr: Expression) -> None:
                 super().__init__()
-                self.inner_expr = inner_expr
+                self.inner_expr = _node(inner_expr)
+                self.body = substitute(func, self.inner_expr)
+
+            def __reduce__(self):
+                return _composite, (name, self.inner_expr)
 
             def __call__(self, x: float) -> float:
-                print(func)
-                print("funk")
-                return func(
-                    self.inner_expr(x)
-                )#(x)
-            
-            def derivative(self) -> "Expression":
-                return Multiply(Composite(func.derivative(), (self.inner_expr).simplify()), self.inner_expr.derivative().simplify())
+                if kernel is not None:
+                    return kernel(self.inner_expr(x))
+                return self.body(x)
+
+            def _lower(self, prog, x):
+                if kernel is not None:
+                    return prog.emit("kernel", prog.lower(self.inner_expr, x), value=type(self))
+                return prog.lower(self.body, x)
+
+            @classmethod
+            def outer_derivative(cls) -> Expression:
+                if cls._outer_derivative is None:
+                    cls._outer_derivative = func.derivative().simplify()
+                return cls._outer_derivative
+
+            def _derivative(self) -> "Expression":
+                d = substitute(self.outer_derivative(), self.inner_expr)
+                if isinstance(self.inner_expr, X):
+                    return d
+                return Multiply(d, self.inner_expr.derivative())
             
             def __repr__(self) -> str:
                 return f"{name}({self.inner_expr.__repr__()})"
 
+        CompositeExpression.func = func
+        CompositeExpression.kernel = staticmethod(kernel) if kernel is not None else None
+        CompositeExpression._outer_derivative = derivative
+        CompositeExpression.__name__ = CompositeExpression.__qualname__ = name
+        composites[name] = CompositeExpression
         return CompositeExpression
+
+
+def substitute(expr: Expression, inner: Expression) -> Expression:
+    """expr with every X replaced by inner, sharing each rebuilt node.
+
+    A Composite only gets inner substituted into its g, and a Polynomial, which has no X
+    node to replace, becomes a Composite of itself and inner.
+    """
+    inner = _node(inner)
+    if isinstance(inner, X):
+        return expr
+    done = {}  # id(node) -> (node, substituted node)
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        if isinstance(node, X):
+            out = inner
+        elif isinstance(node, Polynomial):
+            out = Composite(node, inner)
+        else:
+            if isinstance(node, Derivative):
+                children = (node.expand(),)
+            elif isinstance(node, Composite):
+                children = (node.g,)
+            else:
+                children = node._children()
+            pending = [child for child in children if id(child) not in done]
+            if pending:
+                stack.extend(pending)
+                continue
+            new = [done[id(child)][1] for child in children]
+            if isinstance(node, Derivative):
+                out = new[0]
+            elif isinstance(node, Composite):
+                out = Composite(node.f, new[0])
+            else:
+                out = node._rebuild(new)
+        done[id(node)] = (node, out)
+        stack.pop()
+    return done[id(expr)][1]
+
+
+class Derivative(Expression):
+    """d/dx of expr, expanded one level at a time only when something needs it.
+
+    Expanding applies expr's own derivative rule but leaves the derivatives of its
+    children as further Derivative nodes, and is cached on the node; evaluating,
+    compiling or simplifying expands just the parts they reach. A simplify() rule that
+    discards a branch, like 0 * b, never expands it.
+    """
+    _fields = ("expr",)
+    __slots__ = ("expr", "_expanded")
+
+    def __init__(self, expr: Expression) -> None:
+        super().__init__()
+
+        self.expr = _node(expr)
+
+    def expand(self) -> Expression:
+        try:
+            return self._expanded
+        except AttributeError:
+            pass
+        d = derivative_cache.get(self.expr)
+        if d is None:
+            active = getattr(_lazy, "active", False)
+            _lazy.active = True
+            try:
+                d = fold(self.expr._derivative())
+            finally:
+                _lazy.active = active
+        self._expanded = d
+        return d
+
+    def __call__(self, x: float) -> float:
+        return self.expand()(x)
+
+    def _lower(self, prog, x):
+        return prog.lower(self.expand(), x)
+
+    def _derivative(self) -> Type[Expression]:
+        return self.expand().derivative()
+
+    def __repr__(self):
+        return f"derivative({self.expr.__repr__()})"
+
+    def _rewrite(self):
+        return self.expand()
     
 
 
 
 class X(Expression):
+    __slots__ = ()
+
     def __init__(self, *args) -> None:
         super().__init__()
 
 
     def __call__(self, x: float) -> float:
         return x
+
+    @staticmethod
+    def _lower(prog, x):
+        return x
     
     @staticmethod
-    def derivative() -> Type[Expression]:
+    def _derivative() -> Type[Expression]:
         return Constant(1)
     
     @staticmethod
     def __repr__():
         return "X"
-    
-    @classmethod
-    def simplify(cls):
-        return cls()
+
+class Variable(Expression):
+    """A named input alongside X, for functions of several variables.
+
+    Variable("x") is the same input as a top-level X(); any other name gets its value
+    from the point passed to evaluate(), value_and_gradient() or jacobian().
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        if not name.isidentifier() or keyword.iskeyword(name):
+            raise ValueError(f"variable name must be an identifier, not {name!r}")
+        self.name = name
+
+    def _args(self):
+        return (self.name,)
+
+    def __call__(self, x: float) -> float:
+        if self.name == "x":
+            return x
+        raise TypeError(f"{self.name} has no value; use evaluate() or value_and_gradient()")
+
+    def _lower(self, prog, x):
+        return 0 if self.name == "x" else prog.emit("var", value=self.name)
+
+    def _derivative(self) -> Type[Expression]:
+        # d/dx, holding every other variable constant
+        return Constant(1 if self.name == "x" else 0)
+
+    def __repr__(self):
+        return self.name
+
+class Coefficient(Expression):
+    """A named constant whose value can be changed after the expression is built.
+
+    Coefficient("a") is one node wherever it is used, so setting its value changes
+    every expression it appears in. derivative() treats it as a constant, but it is
+    never folded or simplified away, and compiled functions read its current value.
+    """
+    __slots__ = ("name", "_value", "_watchers")
+
+    def __new__(cls, name: str, value: float = None):
+        # interned on the name alone: the value is mutable state, not structure
+        node = super().__new__(cls, name)
+        if value is not None and id(node) not in _unbuilt: # existing node, __init__ won't run
+            node.value = value
+        return node
+
+    def __init__(self, name: str, value: float = None) -> None:
+        super().__init__()
+        if not name.isidentifier() or keyword.iskeyword(name):
+            raise ValueError(f"coefficient name must be an identifier, not {name!r}")
+        self.name = name
+        self._value = 0.0 if value is None else value
+        self._watchers = weakref.WeakSet() # Incremental evaluations to tell about changes
+
+    def __reduce__(self):
+        return _coefficient, (self.name, self._value)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    @value.setter
+    def value(self, value: float) -> None:
+        self._value = value
+        for watcher in list(self._watchers):
+            watcher._changed(self)
+
+    def __call__(self, x: float) -> float:
+        return self._value
+
+    def _lower(self, prog, x):
+        return prog.emit("coef", value=self)
+
+    def _derivative(self) -> Type[Expression]:
+        return Constant(0)
+
+    def __repr__(self):
+        return self.name
 
 class Constant(Expression):
+    __slots__ = ("k",)
+
     def __init__(self, k: float) -> None:
         super().__init__()
 
         self.k = k
 
+    def _args(self):
+        return (self.k,)
+
     def __call__(self, x: float) -> float:
         return self.k
+
+    def _lower(self, prog, x):
+        return prog.const(self.k)
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Constant(0.0)
     
     def __repr__(self):
         return f"{self.k.__repr__()}"
     
-    def simplify(self):
+    def _rewrite(self):
         if isinstance(self.k, Constant):
             return Constant(self.k.k)
         return self
@@ -116,16 +512,25 @@ class Constant(Expression):
     def __mul__(self, other):
         return Constant(self.k * other.k)
     
-    def __div__(self, other):
-        return Constant(self.k * other.k)
+    def __truediv__(self, other):
+        return Constant(self.k / other.k)
+
+    def __pow__(self, other):
+        value = self.k ** other.k
+        if isinstance(value, complex): # (-8) ** (1/3)
+            raise ValueError(f"{self.k!r} ** {other.k!r} is not real")
+        return Constant(value)
     
 class Multiply(Expression):
+    _fields = ("a", "b")
+    __slots__ = _fields
+
     def __init__(self, a,b) -> None:
         super().__init__()
 
 
-        self.a = a
-        self.b = b
+        self.a = _node(a)
+        self.b = _node(b)
 
     def __call__(self, x: float) -> float:
         # print(self.a)
@@ -133,17 +538,20 @@ class Multiply(Expression):
         # print(x)
         # print("a ax x")
         return self.a(x) * self.b(x)
+
+    def _lower(self, prog, x):
+        return prog.emit("mul", prog.lower(self.a, x), prog.lower(self.b, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Add(Multiply(self.a.derivative(), self.b), Multiply(self.a, self.b.derivative()))
     
     def __repr__(self):
         return f"({self.a.__repr__()} * {self.b.__repr__()})"
     
-    def simplify(self):
+    def _rewrite(self):
         if isinstance(self.a, Constant) and isinstance(self.b, Constant):
-            return Constant(self.a * self.b).simplify()
+            return self.a * self.b
         
         if isinstance(self.a, Constant) and self.a.k == 0.0 or isinstance(self.b, Constant) and self.b.k == 0.0:
             return Constant(0.0)
@@ -154,93 +562,536 @@ class Multiply(Expression):
         if isinstance(self.b, Constant) and self.b.k == 1.0 : # a * 1
             return self.a
 
-        return Multiply(self.a.simplify(), self.b.simplify())
+
+        p, q = _as_polynomial(self.a), _as_polynomial(self.b)
+        if p is not None and q is not None:
+            return p * q
+
+        return self
+
+    def _fold(self):
+        # gather the constant factors into one on the left: c1 * (c2 * e) -> (c1 c2) * e
+        k, rest = 1, []
+        for factor in (self.a, self.b):
+            if isinstance(factor, Multiply) and isinstance(factor.a, Constant):
+                k, factor = k * factor.a.k, factor.b
+            if isinstance(factor, Constant):
+                k = k * factor.k
+            else:
+                rest.append(factor)
+        if k == 0:
+            return Constant(0.0)
+        if not rest: # two constants fold() left alone, their value not being a finite real
+            return self
+        body = rest[0] if len(rest) == 1 else Multiply(*rest)
+        return body if k == 1 else Multiply(Constant(k), body)
 
 
 class Divide(Expression):
+    _fields = ("a", "b")
+    __slots__ = _fields
+
     def __init__(self, a,b) -> None:
         super().__init__()
 
 
-        self.a = a
-        self.b = b
+        self.a = _node(a)
+        self.b = _node(b)
 
     def __call__(self, x: float) -> float:
         return self.a(x) / self.b(x)
+
+    def _lower(self, prog, x):
+        return prog.emit("div", prog.lower(self.a, x), prog.lower(self.b, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Divide(Subtract(Multiply(self.a.derivative(), self.b), Multiply(self.a, self.b.derivative())), Multiply(self.b, self.b))
     
     def __repr__(self):
         return f"({self.a.__repr__()} / {self.b.__repr__()})"
     
-    def simplify(self):
-        self.a = self.a.simplify()
-        self.b = self.b.simplify()
-        if isinstance(self.a, Constant) and isinstance(self.b, Constant):
-            return Constant(self.a / self.b).simplify()
+    def _rewrite(self):
+        if isinstance(self.a, Constant) and isinstance(self.b, Constant) and self.b.k != 0.0:
+            return self.a / self.b
         
         if isinstance(self.b, Constant) and self.b.k == 1.0 : #f(x)/1
             return self.a
-        
-        
 
-        return Divide(self.a.simplify(), self.b.simplify())
+
+        p, q = _as_polynomial(self.a), _as_polynomial(self.b)
+        if p is not None and q is not None and q.degree == 0 and q.terms: # polynomial / nonzero constant
+            return p * Polynomial({0: 1 / q.terms[0][1]})
+
+        return self
+
+    def _fold(self):
+        if isinstance(self.b, Constant) and self.b.k == 1: # a / 1
+            return self.a
+        return self
 
 class Add(Expression):
+    _fields = ("a", "b")
+    __slots__ = _fields
+
     def __init__(self, a,b) -> None:
         super().__init__()
 
 
-        self.a = a
-        self.b = b
+        self.a = _node(a)
+        self.b = _node(b)
 
     def __call__(self, x: float) -> float:
         return self.a(x) + self.b(x)
+
+    def _lower(self, prog, x):
+        return prog.emit("add", prog.lower(self.a, x), prog.lower(self.b, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Add(self.a.derivative(), self.b.derivative())
     
     def __repr__(self):
         return f"({self.a.__repr__()} + {self.b.__repr__()})"
     
-    def simplify(self):
-        self.a = self.a.simplify()
-        self.b = self.b.simplify()
+    def _rewrite(self):
         if isinstance(self.a, Constant) and isinstance(self.b, Constant):
-            return Constant(self.a + self.b).simplify()
+            return self.a + self.b
+
+        if isinstance(self.a, Constant) and self.a.k == 0.0: # 0 + b
+            return self.b
+
+        if isinstance(self.b, Constant) and self.b.k == 0.0: # a + 0
+            return self.a
+
+
+        p, q = _as_polynomial(self.a), _as_polynomial(self.b)
+        if p is not None and q is not None:
+            return p + q
+
+        return self
 
-        return Add(self.a.simplify(), self.b.simplify())
+    def _fold(self):
+        # gather the constant terms into one on the left: c1 + (c2 + e) -> (c1 + c2) + e
+        k, rest = 0, []
+        for term in (self.a, self.b):
+            if isinstance(term, Add) and isinstance(term.a, Constant):
+                k, term = k + term.a.k, term.b
+            if isinstance(term, Constant):
+                k = k + term.k
+            else:
+                rest.append(term)
+        if not rest: # two constants fold() left alone, their value not being a finite real
+            return self
+        body = rest[0] if len(rest) == 1 else Add(*rest)
+        return body if k == 0 else Add(Constant(k), body)
 
 class Subtract(Expression):
+    _fields = ("a", "b")
+    __slots__ = _fields
+
     def __init__(self, a,b) -> None:
         super().__init__()
 
 
-        self.a = a
-        self.b = b
+        self.a = _node(a)
+        self.b = _node(b)
 
     def __call__(self, x: float) -> float:
         return self.a(x) - self.b(x)
+
+    def _lower(self, prog, x):
+        return prog.emit("sub", prog.lower(self.a, x), prog.lower(self.b, x))
     
     
-    def derivative(self) -> Type[Expression]:
+    def _derivative(self) -> Type[Expression]:
         return Subtract(self.a.derivative(), self.b.derivative())
     
     def __repr__(self):
         return f"({self.a.__repr__()} - {self.b.__repr__()})"
     
-    def simplify(self):
-        self.a = self.a.simplify()
-        self.b = self.b.simplify()
+    def _rewrite(self):
         if isinstance(self.a, Constant) and isinstance(self.b, Constant):
-            
-            return Constant(self.a - self.b).simplify()
+            return self.a - self.b
+
+        if isinstance(self.b, Constant) and self.b.k == 0.0: # a - 0
+            return self.a
+
+        p, q = _as_polynomial(self.a), _as_polynomial(self.b)
+        if p is not None and q is not None:
+            return p - q
+
+        if isinstance(self.a, Constant) and self.a.k == 0.0: # 0 - b
+            return Multiply(Constant(-1), self.b)
+
+        return self
+
+    def _fold(self):
+        if isinstance(self.b, Constant) and self.b.k == 0: # a - 0
+            return self.a
+        if isinstance(self.a, Constant) and self.a.k == 0: # 0 - b, so the -1 joins b's constant factor
+            return Multiply(Constant(-1), self.b)._fold()
+        return self
+
+
+def _terms(terms) -> tuple:
+    # canonical form: ((exponent, coefficient), ...) by increasing exponent, no zero terms
+    if isinstance(terms, np.ndarray): # dense, coefficient of x^i at index i
+        terms = enumerate(terms.tolist())
+    elif isinstance(terms, dict):
+        terms = terms.items()
+    merged = {}
+    for e, c in terms:
+        if e < 0 or e != int(e):
+            raise ValueError(f"polynomial exponents must be non-negative integers, not {e!r}")
+        merged[int(e)] = merged.get(int(e), 0.0) + float(c)
+    return tuple((e, c) for e, c in sorted(merged.items()) if c != 0.0)
+
+class Polynomial(Expression):
+    """A polynomial in x stored as sparse (exponent, coefficient) terms.
+
+    Built from a dict {exponent: coefficient}, (exponent, coefficient) pairs, or a dense
+    NumPy coefficient array indexed by exponent. simplify() turns Add/Subtract/Multiply/
+    PolynomialExponent trees over X and Constants into one Polynomial, so like terms are
+    collected and each derivative is another Polynomial with no more terms.
+    """
+    __slots__ = ("terms",)
+
+    def __new__(cls, terms=()):
+        # intern on the canonical terms, so every spelling of a polynomial is one node
+        return super().__new__(cls, _terms(terms))
+
+    def __init__(self, terms=()) -> None:
+        super().__init__()
+
+        self.terms = _terms(terms)
+
+    def _args(self):
+        return (self.terms,)
+
+    @property
+    def degree(self) -> int:
+        return self.terms[-1][0] if self.terms else 0
+
+    def coefficients(self) -> np.ndarray:
+        """Dense coefficient array, coefficient of x^i at index i."""
+        dense = np.zeros(self.degree + 1)
+        for e, c in self.terms:
+            dense[e] = c
+        return dense
+
+    def __call__(self, x: float) -> float:
+        # Horner's scheme, jumping over missing powers; works on arrays too
+        if not self.terms:
+            return 0.0
+        prev, acc = self.terms[-1]
+        for e, c in reversed(self.terms[:-1]):
+            acc = acc * x ** (prev - e) + c
+            prev = e
+        return acc * x ** prev if prev else acc
+
+    def _lower(self, prog, x):
+        def power(n):
+            return x if n == 1 else prog.emit("pow", x, prog.const(n))
+
+        if not self.terms:
+            return prog.const(0.0)
+        prev, c = self.terms[-1]
+        acc = prog.const(c)
+        for e, c in reversed(self.terms[:-1]):
+            acc = prog.emit("add", prog.emit("mul", acc, power(prev - e)), prog.const(c))
+            prev = e
+        return prog.emit("mul", acc, power(prev)) if prev else acc
+
+    def _derivative(self) -> Type[Expression]:
+        return Polynomial(tuple((e - 1, c * e) for e, c in self.terms if e))
+
+    def __repr__(self):
+        if not self.terms:
+            return "0.0"
+        parts = [f"{c!r}" if e == 0 else f"{c!r}*X" if e == 1 else f"{c!r}*X^{e}" for e, c in reversed(self.terms)]
+        return f"({' + '.join(parts)})"
+
+    def _rewrite(self):
+        if not self.terms:
+            return Constant(0.0)
+
+        if self.degree == 0: # just a constant
+            return Constant(self.terms[0][1])
+
+        if self.terms == ((1, 1.0),): # x
+            return X()
+
+        return self
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for e, c in other.terms:
+            terms[e] = terms.get(e, 0.0) + c
+        return Polynomial(terms)
+
+    def __neg__(self):
+        return Polynomial(tuple((e, -c) for e, c in self.terms))
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __mul__(self, other):
+        n, m = len(self.terms), len(other.terms)
+        if n * m > 64 and 2 * n > self.degree and 2 * m > other.degree:
+            # mostly dense: one convolution instead of n*m dict updates
+            return Polynomial(np.convolve(self.coefficients(), other.coefficients()))
+        terms = {}
+        for e, c in self.terms:
+            for f, d in other.terms:
+                terms[e + f] = terms.get(e + f, 0.0) + c * d
+        return Polynomial(terms)
+
+    def __pow__(self, n: int):
+        # repeated squaring, so x^1000 costs ten sparse products
+        result, base = Polynomial({0: 1}), self
+        while n:
+            if n & 1:
+                result = result * base
+            n >>= 1
+            if n:
+                base = base * base
+        return result
+
+
+def _as_polynomial(expr):
+    # the Polynomial an already-simplified node stands for, or None if it isn't one
+    if isinstance(expr, Polynomial):
+        return expr
+    if isinstance(expr, X):
+        return Polynomial({1: 1})
+    if isinstance(expr, Constant) and isinstance(expr.k, (int, float)) and math.isfinite(expr.k):
+        return Polynomial({0: expr.k})
+    return None
+
+
+def _split_point(point: dict):
+    array = any(np.ndim(v) for v in point.values())
+    convert = (lambda v: np.asarray(v, dtype=float)) if array else float
+    point = {name: convert(v) for name, v in point.items()}
+    return point.pop("x", None), point
+
+
+def jacobian(exprs: list, point: dict, variables: list = None) -> np.ndarray:
+    """J[i, j] = d exprs[i] / d variables[j] at point, lowering all exprs together.
+
+    Shared subexpressions between the outputs are computed once, and each row costs one
+    reverse sweep. variables defaults to the sorted names in point; with array values
+    the result has shape (len(exprs), len(variables), *batch shape).
+    """
+    x, env = _split_point(point)
+    variables = sorted(point) if variables is None else variables
+    prog = Program()
+    outputs = [prog.lower(expr, 0) for expr in exprs]
+    rows = prog.gradients(x, env, outputs)
+    batch = np.broadcast_shapes(*(np.shape(v) for v in point.values()))
+    J = np.zeros((len(exprs), len(variables)) + batch)
+    for i, (_, gradient) in enumerate(rows):
+        for j, name in enumerate(variables):
+            J[i, j] = gradient.get(name, 0.0)
+    return J
+
+
+class LRUCache:
+    """A dict bounded to maxsize entries, evicting the least recently used one."""
+
+    def __init__(self, maxsize: int = 65536) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = self.misses = 0
+
+
+# Interned nodes are their own structural key, so the cache can key on the node itself.
+# Entries are node -> derivative and (node, order, simplified) -> nth derivative.
+derivative_cache = LRUCache()
+
+# node -> fold(node); a folded node maps to itself, so folding stops where it reaches one
+fold_cache = LRUCache()
+
+# node -> Program(node), so evaluating one expression at fresh points doesn't lower it again;
+# nodes never change, and Coefficients are read when the program runs
+program_cache = LRUCache(4096)
+
+
+def _lowered(expr: Expression) -> Program:
+    program = program_cache.get(expr)
+    if program is None:
+        program = program_cache[expr] = Program(expr)
+    return program
+
+
+def nth_derivative(expr: Expression, n: int, simplify: bool = True) -> Expression:
+    """The n-th derivative of expr, simplified between steps unless simplify=False.
+
+    Starts from the highest order already in derivative_cache, so asking for the 1st
+    through 4th derivatives in turn only differentiates four times in total.
+    """
+    order = n
+    while order > 0 and (expr, order, simplify) not in derivative_cache:
+        order -= 1
+    d = derivative_cache.get((expr, order, simplify)) if order else expr
+    while order < n:
+        order += 1
+        d = d.derivative()
+        if simplify:
+            d = d.simplify()
+        derivative_cache[(expr, order, simplify)] = d
+    return d
+
+
+def simplify(expr: Expression) -> Expression:
+    """Simplify a whole DAG bottom-up without touching the input nodes.
+
+    Every node is visited once in post-order (iteratively, so deep trees don't hit the
+    recursion limit), results are memoized by node identity, and each node's local
+    _rewrite() rule is applied until it reaches a fixpoint. A rule that already applies
+    before the children are simplified skips them altogether.
+    """
+    done = {}      # id(node) -> (node, simplified node); holding node keeps the id valid
+    rewrites = {}  # id(node) -> (node, rewritten node), so a revisited node isn't rewritten twice
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        children = node._children()
+        pending = [child for child in children if id(child) not in done]
+        if pending and id(node) not in rewrites:
+            # rules like 0 * b hold whatever b is, so try them before simplifying (or
+            # expanding a lazy Derivative in) b
+            early = node._rewrite()
+            if early is node:
+                stack.extend(pending)
+                continue
+            rewrites[id(node)] = (node, early)
+
+        if id(node) not in rewrites:
+            rebuilt = node._rebuild([done[id(child)][1] for child in children])
+            rewrites[id(node)] = (node, rebuilt._rewrite() if rebuilt is node else rebuilt)
+        out = rewrites[id(node)][1]
+        if out is node:
+            done[id(node)] = (node, node)
+            stack.pop()
+        elif id(out) in done:
+            done[id(node)] = (node, done[id(out)][1])
+            stack.pop()
+        else:
+            stack.append(out) # simplify the replacement first, then come back to node
+    return done[id(expr)][1]
+
+
+def _has_coefficient(expr: Expression) -> bool:
+    # whether expr reads a Coefficient anywhere, including inside Composites' f and
+    # fromFunctional bodies, which _children() doesn't reach
+    seen = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, Coefficient):
+            return True
+        stack.extend(node._children())
+        if isinstance(node, Composite):
+            stack.append(node.f)
+        elif hasattr(type(node), "func"): # made by fromFunctional
+            stack.append(node.body)
+    return False
+
+
+def _constant_value(node):
+    # the value of a node whose inputs are all Constants, or None if it isn't one or the
+    # value isn't a finite real number
+    if not node._fields or isinstance(node, Derivative):
+        return None
+    inputs = (node.g,) if isinstance(node, Composite) else node._children()
+    if not all(isinstance(child, Constant) for child in inputs):
+        return None
+    if (isinstance(node, Composite) or hasattr(type(node), "func")) and _has_coefficient(node):
+        return None # a Composite's f or a fromFunctional body reading a Coefficient
+    try:
+        with np.errstate(all="ignore"):
+            value = node(0.0)
+    except (ArithmeticError, ValueError, TypeError): # e.g. ln(-1); left for evaluation to report
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if not isinstance(value, (int, float)) or not math.isfinite(value): # e.g. (-8) ^ (1/3) is complex
+        return None
+    return value
+
 
-        return Subtract(self.a, self.b)
+def fold(expr: Expression) -> Expression:
+    """Collapse every subtree without X or Variables in it to one Constant.
 
+    Also drops exact identities (1 * e, e + 0, e / 1, e ^ 1, ...) and gathers the
+    constant factors of Multiply and terms of Add chains into one. Much cheaper than
+    simplify(), and run on every derivative(); results go in fold_cache, so nodes that
+    were already folded, like the children's derivatives, aren't walked again. Lazy
+    Derivative nodes are left as they are.
+    """
+    done = {}  # id(node) -> (node, folded node)
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        cached = fold_cache.get(node)
+        if cached is not None:
+            done[id(node)] = (node, cached)
+            stack.pop()
+            continue
+        children = () if isinstance(node, Derivative) else node._children()
+        pending = [child for child in children if id(child) not in done]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        out = node._rebuild([done[id(child)][1] for child in children]) if children else node
+        value = _constant_value(out)
+        if value is not None:
+            out = Constant(value)
+        elif isinstance(out, Constant):
+            out = out._rewrite() # Constant(Constant(k))
+        else:
+            out = out._fold()
+        done[id(node)] = (node, out)
+        fold_cache[node] = out
+        fold_cache[out] = out
+    return done[id(expr)][1]
 
 
 if __name__ == "__main__":
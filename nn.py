@@ -1,13 +1,62 @@
 from modules import *
 from extra import *
 from compositions import *
+from array import array
+import numpy as np
+
+
+# bumped whenever an existing node's _parents is assigned, so cached orders know they are stale
+_graph_version = 0
+
+
+class _Parents:
+    """The _parents attribute of Parameter and Tensor.
+
+    Stored as a tuple, so the only way to change a node's parents is to assign them,
+    and every assignment bumps _graph_version. Nodes being created set _edges directly:
+    no cached order can include them yet.
+    """
+    def __get__(self, node, owner=None):
+        return self if node is None else node._edges
+
+    def __set__(self, node, parents) -> None:
+        global _graph_version
+        _graph_version += 1
+        node._edges = tuple(parents)
+
+
+def _topological_order(root) -> list:
+    """Nodes of the graph ending at root, each after every node that uses it.
+
+    Built iteratively so deep graphs don't hit the recursion limit; callers cache the
+    result until some node's parents are reassigned.
+    """
+    order = []
+    visited = {id(root)}
+    stack = [(root, iter(root._parents))]
+    while stack:
+        node, parents = stack[-1]
+        for parent, _ in parents:
+            if id(parent) not in visited:
+                visited.add(id(parent))
+                stack.append((parent, iter(parent._parents)))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+    order.reverse()
+    return order
+
+
 class Parameter:
+    _parents = _Parents()
+
     def __init__(self, value: float) -> None:
         self.value = value  # The value of the parameter (the actual number)
         self._grad = 0.0    # Gradient with respect to this parameter
-        self._parents = []  # Parents and their local gradients
+        self._edges = ()    # Parents and their local gradients
         self._op = None     # Store the operation ('add', 'mul', etc.) for tracking
-        self._local_grads = []  # Store local gradients for chain rule
+        self._order = None      # (graph version, topological order of the graph ending here)
 
     def __repr__(self) -> str:
         return f"Parameter(value={self.value}, grad={self._grad})"
@@ -16,7 +65,7 @@ class Parameter:
     def __add__(self, other):
         if isinstance(other, Parameter):
             out = Parameter(self.value + other.value)
-            out._parents = [(self, 1), (other, 1)]  # Local gradients w.r.t inputs
+            out._edges = ((self, 1), (other, 1))  # Local gradients w.r.t inputs
             out._op = "add"
             return out
         else:
@@ -25,7 +74,7 @@ class Parameter:
     def __sub__(self, other):
         if isinstance(other, Parameter):
             out = Parameter(self.value - other.value)
-            out._parents = [(self, 1), (other, -1)]  # Local gradients w.r.t inputs
+            out._edges = ((self, 1), (other, -1))  # Local gradients w.r.t inputs
             out._op = "sub"
             return out
         else:
@@ -34,7 +83,7 @@ class Parameter:
     def __mul__(self, other):
         if isinstance(other, Parameter):
             out = Parameter(self.value * other.value)
-            out._parents = [(self, other.value), (other, self.value)]  # Local gradients
+            out._edges = ((self, other.value), (other, self.value))  # Local gradients
             out._op = "mul"
             return out
         else:
@@ -43,7 +92,7 @@ class Parameter:
     def __truediv__(self, other):
         if isinstance(other, Parameter):
             out = Parameter(self.value / other.value)
-            out._parents = [(self, 1 / other.value), (other, -self.value / (other.value ** 2))]  # Chain rule for division
+            out._edges = ((self, 1 / other.value), (other, -self.value / (other.value ** 2)))  # Chain rule for division
             out._op = "div"
             return out
         else:
@@ -51,40 +100,387 @@ class Parameter:
 
     def __neg__(self):
         out = Parameter(-self.value)
-        out._parents = [(self, -1)]  # Local gradient w.r.t input
+        out._edges = ((self, -1),)  # Local gradient w.r.t input
         out._op = "neg"
         return out
 
+    def __pow__(self, exponent: float):
+        out = Parameter(self.value ** exponent)
+        out._edges = ((self, exponent * self.value ** (exponent - 1)),)
+        out._op = "pow"
+        return out
+
     # Backward pass: accumulate gradients using chain rule
     def backward(self, grad: float = 1.0) -> None:
-        """Recursively accumulate gradients by propagating backwards."""
-        # Add the current gradient to this parameter
-        self._grad += grad
-        
-        # Propagate to parents (if any)
-        for parent, local_grad in self._parents:
-            parent.backward(grad * local_grad)
+        """Add d self / d node, times grad, to the _grad of every node self depends on.
+
+        Each node is visited once, in reverse topological order, however many paths lead
+        to it.
+        """
+        grads = {id(self): grad}
+        for node in self.topological_order():
+            node_grad = grads.pop(id(node), 0.0)
+            node._grad += node_grad
+            for parent, local_grad in node._parents:
+                grads[id(parent)] = grads.get(id(parent), 0.0) + node_grad * local_grad
+
+    def topological_order(self) -> list:
+        """Nodes of the graph ending here, each after every node that uses it (cached)."""
+        if self._order is None or self._order[0] != _graph_version:
+            self._order = (_graph_version, _topological_order(self))
+        return self._order[1]
 
     # Reset gradients (for the next iteration, typical in optimizers)
     def zero_grad(self) -> None:
         self._grad = 0.0
 
+    def update(self, lr: float) -> None:
+        """One plain gradient descent step."""
+        self.value -= lr * self._grad
+
+class Tape:
+    """A scalar autograd graph recorded into preallocated columns instead of objects.
+
+    Every value is an int index into the tape; each op appends one row of (opcode,
+    input indices, local gradients) plus its value, so recording allocates no Python
+    objects beyond the numbers themselves. The columns double when full, and reset()
+    rewinds to a mark without freeing them, so a training loop records its
+    parameters once and then reuses the same memory every iteration:
+
+        tape = Tape()
+        w, b = tape.leaf(0.5), tape.leaf(0.0)
+        start = len(tape)
+        for x, y in data:
+            tape.reset(start)
+            err = tape.sub(tape.add(tape.mul(w, tape.leaf(x)), b), tape.leaf(y))
+            tape.backward(tape.mul(err, err))
+            tape.update(0.01, (w, b))
+            tape.zero_grad()
+    """
+    OPS = ("leaf", "add", "sub", "mul", "div", "neg", "pow")
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.capacity = capacity
+        self._n = 0
+        self.ops = array("b", bytes(capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.grads = array("d", bytes(8 * capacity))
+        self.a = array("i", bytes(4 * capacity))   # first input index, -1 if none
+        self.b = array("i", bytes(4 * capacity))   # second input index, -1 if none
+        self.da = array("d", bytes(8 * capacity))  # d value / d input a
+        self.db = array("d", bytes(8 * capacity))  # d value / d input b
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _grow(self) -> None:
+        for column in (self.ops, self.values, self.grads, self.a, self.b, self.da, self.db):
+            column.frombytes(bytes(column.itemsize * self.capacity))
+        self.capacity *= 2
+
+    def _push(self, op: int, value: float, a: int, da: float, b: int, db: float) -> int:
+        i = self._n
+        if i == self.capacity:
+            self._grow()
+        self.ops[i] = op
+        self.values[i] = value
+        self.grads[i] = 0.0
+        self.a[i] = a
+        self.da[i] = da
+        self.b[i] = b
+        self.db[i] = db
+        self._n = i + 1
+        return i
+
+    def leaf(self, value: float) -> int:
+        return self._push(0, value, -1, 0.0, -1, 0.0)
+
+    def add(self, a: int, b: int) -> int:
+        return self._push(1, self.values[a] + self.values[b], a, 1.0, b, 1.0)
+
+    def sub(self, a: int, b: int) -> int:
+        return self._push(2, self.values[a] - self.values[b], a, 1.0, b, -1.0)
+
+    def mul(self, a: int, b: int) -> int:
+        va, vb = self.values[a], self.values[b]
+        return self._push(3, va * vb, a, vb, b, va)
+
+    def div(self, a: int, b: int) -> int:
+        vb = self.values[b]
+        q = self.values[a] / vb
+        return self._push(4, q, a, 1 / vb, b, -q / vb)
+
+    def neg(self, a: int) -> int:
+        return self._push(5, -self.values[a], a, -1.0, -1, 0.0)
+
+    def pow(self, a: int, exponent: float) -> int:
+        va = self.values[a]
+        return self._push(6, va ** exponent, a, exponent * va ** (exponent - 1), -1, 0.0)
+
+    def value(self, i: int) -> float:
+        return self.values[i]
+
+    def grad(self, i: int) -> float:
+        return self.grads[i]
+
+    def backward(self, root: int, grad: float = 1.0) -> None:
+        """Accumulate d root / d leaf into the grads of every leaf, in one reverse sweep.
+
+        Rows are in the order they were recorded, so inputs always come before the ops
+        using them and a single pass from root down to 0 visits each op once.
+        """
+        ops = np.frombuffer(self.ops, dtype=np.int8, count=root + 1)
+        grads = np.frombuffer(self.grads, count=root + 1)
+        grads[ops != 0] = 0.0 # adjoints left over from an earlier backward
+        del ops, grads        # release the buffers so the columns can grow again
+        grads, a, b, da, db = self.grads, self.a, self.b, self.da, self.db
+        grads[root] += grad
+        for i in range(root, -1, -1):
+            g = grads[i]
+            j = a[i]
+            if j < 0 or g == 0.0: # a leaf, or nothing flows through here
+                continue
+            grads[j] += g * da[i]
+            j = b[i]
+            if j >= 0:
+                grads[j] += g * db[i]
+
+    def update(self, lr: float, leaves) -> None:
+        """One plain gradient descent step for the given leaves, in place."""
+        values, grads = self.values, self.grads
+        for i in leaves:
+            values[i] -= lr * grads[i]
+
+    def zero_grad(self) -> None:
+        grads = np.frombuffer(self.grads, count=self._n)
+        grads[:] = 0.0
+        del grads
+
+    def reset(self, mark: int = 0) -> None:
+        """Forget every row recorded after the first mark, keeping the memory."""
+        self._n = mark
+
+
+def _unbroadcast(grad: np.ndarray, shape: tuple) -> np.ndarray:
+    # sum a gradient over the axes that broadcasting stretched, back down to shape
+    while grad.ndim > len(shape):
+        grad = grad.sum(axis=0)
+    for axis, size in enumerate(shape):
+        if size == 1 and grad.shape[axis] != 1:
+            grad = grad.sum(axis=axis, keepdims=True)
+    return grad
+
+
+def _as_tensor(value) -> "Tensor":
+    if isinstance(value, Tensor):
+        return value
+    if isinstance(value, Parameter):
+        # a copy would never see the gradient, so the caller's Parameter would stay at 0
+        raise TypeError("can't mix Parameter and Tensor in one graph")
+    return Tensor(value)
+
+
+def _as_parameter(value) -> Parameter:
+    if isinstance(value, Parameter):
+        return value
+    if isinstance(value, Tensor):
+        raise TypeError("can't mix Parameter and Tensor in one graph")
+    return Parameter(float(value))
+
+
+class Tensor:
+    """A NumPy array in the autograd graph; the array counterpart of Parameter.
+
+    Each op records its parents with a function mapping the output gradient to that
+    parent's gradient, so backward runs one vectorized rule per op instead of one
+    Python object per scalar. Ops also keep the function computing their value, and
+    every rule reads the current values, so after changing the leaves' values
+    recompute() brings the graph up to date and it can be used for another backward.
+    """
+    _parents = _Parents()
+    __array_ufunc__ = None # array - tensor calls Tensor.__rsub__ instead of looping over the array
+
+    def __init__(self, value) -> None:
+        self.value = np.asarray(value, dtype=float)
+        self._grad = np.zeros_like(self.value)
+        self._edges = ()  # (parent, output grad -> parent grad)
+        self._op = None
+        self._forward = None # () -> value, for recompute()
+        self._order = None
+
+    def __repr__(self) -> str:
+        return f"Tensor(value={self.value}, grad={self._grad})"
+
+    @property
+    def shape(self) -> tuple:
+        return self.value.shape
+
+    def _make(self, forward, op: str, *parents) -> "Tensor":
+        out = Tensor(forward())
+        out._edges = parents
+        out._op = op
+        out._forward = forward
+        return out
+
+    def __add__(self, other):
+        other = _as_tensor(other)
+        return self._make(lambda: self.value + other.value, "add", (self, lambda g: g), (other, lambda g: g))
+
+    def __sub__(self, other):
+        other = _as_tensor(other)
+        return self._make(lambda: self.value - other.value, "sub", (self, lambda g: g), (other, lambda g: -g))
+
+    def __mul__(self, other):
+        other = _as_tensor(other)
+        return self._make(lambda: self.value * other.value, "mul",
+                          (self, lambda g: g * other.value), (other, lambda g: g * self.value))
+
+    def __truediv__(self, other):
+        other = _as_tensor(other)
+        return self._make(lambda: self.value / other.value, "div",
+                          (self, lambda g: g / other.value),
+                          (other, lambda g: -g * self.value / other.value ** 2))
+
+    def __radd__(self, other):
+        return _as_tensor(other) + self
+
+    def __rsub__(self, other):
+        return _as_tensor(other) - self
+
+    def __rmul__(self, other):
+        return _as_tensor(other) * self
+
+    def __rtruediv__(self, other):
+        return _as_tensor(other) / self
+
+    def __rmatmul__(self, other):
+        return _as_tensor(other) @ self
+
+    def __neg__(self):
+        return self._make(lambda: -self.value, "neg", (self, lambda g: -g))
+
+    def __pow__(self, exponent: float):
+        return self._make(lambda: self.value ** exponent, "pow",
+                          (self, lambda g: g * exponent * self.value ** (exponent - 1)))
+
+    def __matmul__(self, other):
+        other = _as_tensor(other)
+        # a 1-D operand is a row (on the left) or a column (on the right) matrix, as in
+        # np.matmul; the stacked 2-D rules then apply, and the added axis is dropped again
+        row, column = self.value.ndim == 1, other.value.ndim == 1
+
+        def promoted(g):
+            a = self.value[None, :] if row else self.value
+            b = other.value[:, None] if column else other.value
+            g = np.asarray(g)
+            if column:
+                g = g[..., None]
+            if row:
+                g = g[..., None, :]
+            return a, b, g
+
+        def grad_a(g):
+            a, b, g = promoted(g)
+            grad = g @ b.swapaxes(-1, -2)
+            return grad[..., 0, :] if row else grad
+
+        def grad_b(g):
+            a, b, g = promoted(g)
+            grad = a.swapaxes(-1, -2) @ g
+            return grad[..., 0] if column else grad
+
+        return self._make(lambda: self.value @ other.value, "matmul", (self, grad_a), (other, grad_b))
+
+    def sum(self, axis=None, keepdims: bool = False):
+        def grad(g):
+            if axis is not None and not keepdims:
+                g = np.expand_dims(g, axis)
+            return np.broadcast_to(g, self.value.shape)
+        return self._make(lambda: self.value.sum(axis=axis, keepdims=keepdims), "sum", (self, grad))
+
+    def mean(self, axis=None, keepdims: bool = False):
+        total = self.sum(axis=axis, keepdims=keepdims)
+        return total / (self.value.size // max(total.value.size, 1))
+
+    def backward(self, grad=None) -> None:
+        """Backpropagate grad (ones by default) into the _grad of every Tensor in the graph.
+
+        Each op's rule maps the whole output gradient to its parents' in one NumPy call,
+        and gradients broadcast into a parent are summed back to its shape.
+        """
+        grads = {id(self): np.ones_like(self.value) if grad is None else np.asarray(grad, dtype=float)}
+        for node in self.topological_order():
+            node_grad = grads.pop(id(node), None)
+            if node_grad is None:
+                continue
+            node._grad += node_grad
+            for parent, grad_fn in node._parents:
+                parent_grad = _unbroadcast(grad_fn(node_grad), parent.value.shape)
+                if id(parent) in grads:
+                    grads[id(parent)] = grads[id(parent)] + parent_grad
+                else:
+                    grads[id(parent)] = parent_grad
+
+    def topological_order(self) -> list:
+        """Nodes of the graph ending here, each after every node that uses it (cached)."""
+        if self._order is None or self._order[0] != _graph_version:
+            self._order = (_graph_version, _topological_order(self))
+        return self._order[1]
+
+    def recompute(self) -> "Tensor":
+        """Recompute every value in the graph from the leaves' current values."""
+        for node in reversed(self.topological_order()):
+            if node._forward is not None:
+                node.value = node._forward()
+        return self
+
+    def zero_grad(self) -> None:
+        if self._grad.shape == self.value.shape:
+            self._grad.fill(0.0) # reuse the buffer
+        else:
+            self._grad = np.zeros_like(self.value)
+
+    def update(self, lr: float) -> None:
+        """One plain gradient descent step, in place."""
+        self.value -= lr * self._grad
+
+
 class Linear():
-    def __init__(self, weight: Parameter, bias: Parameter) -> None:
+    """w*x + b over two scalar Parameters, or x @ W + b over Tensors.
+
+    The weight and bias passed in are used as they are, so backward() fills their _grad.
+    """
+    def __init__(self, weight, bias) -> None:
         super().__init__()
-        self.weight = weight
-        self.bias = bias
+        if isinstance(weight, Parameter) or isinstance(bias, Parameter):
+            self.weight = _as_parameter(weight)
+            self.bias = _as_parameter(bias)
+        else:
+            self.weight = _as_tensor(weight)
+            self.bias = _as_tensor(bias)
 
-    def __call__(self, x: float) -> float:
+    def __call__(self, x):
+        if isinstance(self.weight, Parameter):
+            return self.weight * _as_parameter(x) + self.bias
+        if self.weight.value.ndim == 2:
+            return _as_tensor(x) @ self.weight + self.bias  # x @ W + b over a batch
         return self.weight * x + self.bias  # w*x + b
+
+    def parameters(self) -> list:
+        return [self.weight, self.bias]
     
 class MSELoss():
-    def __init__(self, prediction: Parameter, target: float) -> None:
+    def __init__(self, prediction, target) -> None:
         super().__init__()
-        self.prediction = prediction
+        self.prediction = prediction # a Tensor, or a model called on x
         self.target = target
 
-    def __call__(self, x: float) -> float:
-        return (self.prediction - self.target) ** 2
-
-
+    def __call__(self, x=None) -> Tensor:
+        prediction = self.prediction(x) if callable(self.prediction) else self.prediction
+        if isinstance(prediction, Parameter):
+            return (prediction - _as_parameter(self.target)) ** 2
+        target = _as_tensor(self.target)
+        if target.value.ndim and target.shape != prediction.shape:
+            # (B,) against (B, 1) would broadcast to a (B, B) matrix of wrong residuals
+            raise ValueError(f"target shape {target.shape} doesn't match prediction shape {prediction.shape}")
+        return ((prediction - target) ** 2).mean()
@@ -1,37 +1,296 @@
+import unittest
 from nn import *
+from train import Trainer, Optimizer, SGD, Momentum, Adam
+import instrument
+
+
+class TestBackward(unittest.TestCase):
+
+    def test_linear_gradients(self):
+        w, x, b = Parameter(2.0), Parameter(3.0), Parameter(1.0)
+        (w * x + b).backward()
+        self.assertEqual((w._grad, x._grad, b._grad), (3.0, 2.0, 1.0))
+
+    def test_reused_value_accumulates_every_path(self):
+        # y = 2^60 * x reached through 2^60 paths; recursing per path would never finish
+        x = Parameter(1.0)
+        y = x
+        for _ in range(60):
+            y = y + y
+        y.backward()
+        self.assertEqual(x._grad, 2.0 ** 60)
+        self.assertEqual(len(y.topological_order()), 61)
+
+    def test_deep_graph_does_not_recurse(self):
+        x = Parameter(1.0)
+        y = x
+        for _ in range(10000):
+            y = y * Parameter(1.0)
+        y.backward()
+        self.assertEqual(x._grad, 1.0)
+
+    def test_order_is_cached(self):
+        a, b = Parameter(2.0), Parameter(5.0)
+        y = a * b - a
+        self.assertIs(y.topological_order(), y.topological_order())
+        y.backward()
+        y.backward()
+        self.assertEqual((a._grad, b._grad), (8.0, 4.0))
+
+    def test_new_nodes_keep_cached_orders(self):
+        a, b = Parameter(2.0), Parameter(5.0)
+        y = a * b - a
+        order = y.topological_order()
+        Parameter(0.0)
+        a * b
+        Tensor(1.0) + Tensor(2.0)
+        self.assertIs(y.topological_order(), order)
+
+    def test_order_follows_rewired_graph(self):
+        a, b, c = Parameter(2.0), Parameter(5.0), Parameter(3.0)
+        h = a * b
+        y = h + a
+        self.assertEqual(len(y.topological_order()), 4)
+        h._parents = [(c, 1.0)] # below the cached root
+        self.assertEqual(len(y.topological_order()), 4)
+        y.backward()
+        self.assertEqual((a._grad, b._grad, c._grad), (1.0, 0.0, 1.0))
+
+
+class TestInstrument(unittest.TestCase):
+
+    def test_graph_stats_and_backward_profile(self):
+        w = Parameter(2.0)
+        with instrument.Profile() as profile:
+            y = w
+            for _ in range(10):
+                y = y * w + Parameter(1.0)
+            y.backward()
+        stats = instrument.GraphStats(y)
+        self.assertEqual((stats.nodes, stats.leaves, stats.depth), (31, 11, 21))
+        self.assertEqual(stats.ops, {"add": 10, "mul": 10})
+        self.assertEqual(profile.as_dict()["Parameter"]["backward"]["calls"], 1)
+        self.assertEqual(profile.peak_live, 30)
+
+
+class TestTensor(unittest.TestCase):
+
+    def assertGradientMatches(self, f, value, eps=1e-6):
+        x = Tensor(value)
+        f(x).backward()
+        numeric = np.zeros_like(x.value)
+        for i in np.ndindex(x.value.shape):
+            up, down = x.value.copy(), x.value.copy()
+            up[i] += eps
+            down[i] -= eps
+            numeric[i] = (f(Tensor(up)).value - f(Tensor(down)).value) / (2 * eps)
+        np.testing.assert_allclose(x._grad, numeric, rtol=1e-5, atol=1e-6)
+
+    def test_elementwise_ops_and_broadcasting(self):
+        rng = np.random.default_rng(0)
+        a, b = Tensor(rng.normal(size=(4, 3))), Tensor(rng.normal(size=3))
+        self.assertGradientMatches(lambda x: ((x * b - 1.5) / (x ** 2 + 1) + -x).sum(), rng.normal(size=(4, 3)))
+        self.assertGradientMatches(lambda x: (a * x).sum(), rng.normal(size=3))
+
+    def test_stacked_matmul_with_vectors(self):
+        rng = np.random.default_rng(2)
+        stack, v, u = rng.normal(size=(5, 2, 3)), rng.normal(size=3), rng.normal(size=(5, 3, 2))
+        weights = rng.normal(size=(5, 2))
+        self.assertGradientMatches(lambda x: ((x @ Tensor(v)) * Tensor(weights)).sum(), stack)
+        self.assertGradientMatches(lambda x: ((Tensor(stack) @ x) * Tensor(weights)).sum(), v)
+        self.assertGradientMatches(lambda x: ((x @ Tensor(u)) * Tensor(weights)).sum(), v)
+        self.assertGradientMatches(lambda x: ((Tensor(v) @ x) * Tensor(weights)).sum(), u)
+
+    def test_arrays_on_the_left_stay_in_the_graph(self):
+        x = Tensor([1.0, 2.0, 3.0])
+        target = np.array([2.0, 2.0, 2.0])
+        loss = ((target - x) ** 2).sum() + (np.ones(3) * x).sum() + (np.ones((2, 3)) @ x).sum()
+        self.assertIsInstance(loss, Tensor)
+        loss.backward()
+        np.testing.assert_allclose(x._grad, 2 * (x.value - target) + 1 + 2)
+
+    def test_matmul_and_reductions(self):
+        rng = np.random.default_rng(1)
+        w = rng.normal(size=(3, 2))
+        self.assertGradientMatches(lambda x: (x @ Tensor(w)).mean(axis=0).sum(), rng.normal(size=(5, 3)))
+        self.assertGradientMatches(lambda x: (Tensor(w.T) @ x).sum(), rng.normal(size=3))
+
+    def test_linear_mse_loss(self):
+        rng = np.random.default_rng(2)
+        x, y = rng.normal(size=(8, 3)), rng.normal(size=(8, 2))
+        model = Linear(Tensor(rng.normal(size=(3, 2))), Tensor(np.zeros(2)))
+        loss = MSELoss(model, y)(x)
+        loss.backward()
+        residual = x @ model.weight.value + model.bias.value - y
+        self.assertAlmostEqual(float(loss.value), float((residual ** 2).mean()))
+        np.testing.assert_allclose(model.weight._grad, 2 * x.T @ residual / residual.size)
+        np.testing.assert_allclose(model.bias._grad, 2 * residual.sum(axis=0) / residual.size)
+
+    def test_scalar_linear_still_works(self):
+        loss = MSELoss(Linear(2.0, 1.0), 10.0)(3.0)
+        self.assertEqual(float(loss.value), 9.0)
+
+    def test_linear_keeps_callers_parameters(self):
+        w, b = Parameter(2.0), Parameter(1.0)
+        model = Linear(w, b)
+        self.assertIs(model.weight, w)
+        MSELoss(model, 10.0)(3.0).backward()
+        self.assertEqual((w._grad, b._grad), (-18.0, -6.0))
+
+    def test_parameter_and_tensor_dont_mix(self):
+        with self.assertRaises(TypeError):
+            Linear(Parameter(2.0), Tensor(1.0))
+        with self.assertRaises(TypeError):
+            Tensor(1.0) + Parameter(2.0)
+
+
+class TestTape(unittest.TestCase):
+
+    def test_matches_parameter_graph(self):
+        tape = Tape()
+        values = (1.5, -2.0, 0.75)
+        p = [Parameter(v) for v in values]
+        t = [tape.leaf(v) for v in values]
+        y = ((p[0] * p[1] + p[2]) / (p[0] - p[2])) ** 3 + -p[1]
+        root = tape.add(tape.pow(tape.div(tape.add(tape.mul(t[0], t[1]), t[2]), tape.sub(t[0], t[2])), 3), tape.neg(t[1]))
+        y.backward()
+        tape.backward(root)
+        self.assertAlmostEqual(tape.value(root), y.value)
+        for param, leaf in zip(p, t):
+            self.assertAlmostEqual(tape.grad(leaf), param._grad)
+
+    def test_reused_value_and_repeated_backward(self):
+        tape = Tape()
+        x = tape.leaf(1.0)
+        y = x
+        for _ in range(60):
+            y = tape.add(y, y)
+        tape.backward(y)
+        self.assertEqual(tape.grad(x), 2.0 ** 60)
+        a, b = tape.leaf(2.0), tape.leaf(5.0)
+        y = tape.sub(tape.mul(a, b), a)
+        tape.backward(y)
+        tape.backward(y) # leaves accumulate, intermediate adjoints don't
+        self.assertEqual((tape.grad(a), tape.grad(b)), (8.0, 4.0))
+
+    def test_reset_reuses_memory(self):
+        tape = Tape(capacity=4)
+        w = tape.leaf(0.0)
+        start = len(tape)
+        for _ in range(3):
+            for x in (1.0, 2.0, 3.0):
+                tape.reset(start)
+                err = tape.sub(tape.mul(w, tape.leaf(x)), tape.leaf(2 * x))
+                tape.backward(tape.mul(err, err))
+                tape.update(0.05, (w,))
+                tape.zero_grad()
+        self.assertEqual(tape.capacity, 8) # grown once, on the first iteration
+        self.assertEqual(len(tape), 6)
+        self.assertAlmostEqual(tape.value(w), 2.0, places=2)
+
+class TestTraining(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.x = rng.normal(size=(512, 3))
+        self.w = rng.normal(size=(3, 1))
+        self.y = self.x @ self.w - 0.25
+
+    def model(self):
+        return Linear(Tensor(np.zeros((3, 1))), Tensor(np.zeros(1)))
+
+    def test_optimizer_needs_a_step(self):
+        with self.assertRaises(TypeError):
+            Optimizer(self.model().parameters(), 0.1)
+
+    def test_optimizers_fit_linear_regression(self):
+        for optimizer, epochs in [(lambda p: SGD(p, 0.1), 20), (lambda p: Momentum(p, 0.05), 20),
+                                  (lambda p: Adam(p, 0.05), 40)]:
+            model = self.model()
+            weight = model.weight.value
+            history = Trainer(model, optimizer(model.parameters()), batch_size=64).fit(self.x, self.y, epochs, seed=0)
+            self.assertIs(model.weight.value, weight) # updated in place
+            np.testing.assert_allclose(weight, self.w, atol=1e-3)
+            self.assertAlmostEqual(float(model.bias.value[0]), -0.25, delta=1e-3)
+            self.assertLess(history[-1]["loss"], 1e-5)
+            self.assertEqual(len(history), epochs * 8)
+            self.assertEqual(history[0]["samples"], 64)
+            self.assertGreater(history[0]["samples_per_s"], 0)
+
+    def test_graph_is_reused(self):
+        model = self.model()
+        trainer = Trainer(model, SGD(model.parameters(), 0.1), batch_size=100)
+        trainer.fit(self.x, self.y)
+        self.assertEqual(len(trainer._graphs), 2) # batches of 100, and the last 12
+        with instrument.Profile() as profile:
+            trainer.fit(self.x, self.y, epochs=2)
+        self.assertEqual(profile.peak_live, 0) # no Tensors created after the first epoch
+
+    def test_accumulation_matches_one_large_batch(self):
+        large, small = self.model(), self.model()
+        Trainer(large, SGD(large.parameters(), 0.1), batch_size=64).fit(self.x[:64], self.y[:64], shuffle=False)
+        Trainer(small, SGD(small.parameters(), 0.1), batch_size=16, accumulate=4).fit(self.x[:64], self.y[:64], shuffle=False)
+        np.testing.assert_allclose(small.weight.value, large.weight.value)
+        np.testing.assert_allclose(small.bias.value, large.bias.value)
+
+    def test_one_dimensional_targets(self):
+        w = np.array([[-0.756], [0.531], [0.738]])
+        y = (self.x @ w).ravel()
+        model = self.model()
+        history = Trainer(model, SGD(model.parameters(), 0.1), batch_size=64).fit(self.x, y, 20, seed=0)
+        np.testing.assert_allclose(model.weight.value, w, atol=1e-3)
+        self.assertLess(history[-1]["loss"], 1e-5)
+        with self.assertRaises(ValueError):
+            MSELoss(model, Tensor(y[:4]))(Tensor(self.x[:4]))
+        with self.assertRaises(ValueError):
+            Trainer(model, SGD(model.parameters(), 0.1)).fit(self.x, np.zeros((512, 2)))
+
+    def test_reused_graph_gradients_dont_grow(self):
+        model = self.model()
+        trainer = Trainer(model, SGD(model.parameters(), 0.0), batch_size=512)
+        trainer.fit(self.x, self.y, shuffle=False)
+        (_, _, _, others), = trainer._graphs.values()
+        first = [node._grad.copy() for node in others]
+        trainer.fit(self.x, self.y, epochs=3, shuffle=False)
+        for node, grad in zip(others, first):
+            np.testing.assert_allclose(node._grad, grad)
+
+    def test_update_and_recompute(self):
+        w = Parameter(2.0)
+        (w * Parameter(3.0)).backward()
+        w.update(0.1)
+        self.assertAlmostEqual(w.value, 1.7)
+        a = Tensor([1.0, 2.0])
+        y = ((a * a) @ Tensor([1.0, 1.0]))
+        a.value[...] = [3.0, 4.0]
+        self.assertEqual(float(y.recompute().value), 25.0)
+        y.backward()
+        np.testing.assert_allclose(a._grad, [6.0, 8.0])
 
 
 if __name__ == "__main__":
-    # Define a simple linear model: y = w*x + b
-    w = Parameter(2.0)  # Initial weight
-    b = Parameter(1.0)  # Initial bias
-    model = Linear(w, b)
+    # Fit y = w*x + b to one point by gradient descent
+    model = Linear(Tensor(2.0), Tensor(1.0))  # initial weight and bias
+    w, b = model.parameters()
 
     # Target value and input
     target = 10.0
     x = 3.0
 
-    # Define loss function
     loss = MSELoss(model, target)
+    optimizer = SGD(model.parameters(), lr=0.01)
+    for step in range(5):
+        optimizer.zero_grad()
 
-    # Forward pass: compute the loss
-    output = loss(x)
-    print(f"Loss: {output}")
-
-    # Backward pass: compute the gradients
-    d_loss = loss.derivative()
-    print(f"Loss derivative: {d_loss}")
-
-    # Compute gradients for the parameters
-    # We need to evaluate the loss derivative with respect to the input (x)
-    w.grad = d_loss(x) * x  # Gradient w.r.t weight
-    b.grad = d_loss(x)      # Gradient w.r.t bias
+        # Forward pass: compute the loss
+        output = loss(x)
+        print(f"Loss: {output.value}")
 
-    print(f"w.grad: {w.grad}, b.grad: {b.grad}")
+        # Backward pass: gradients for every parameter
+        output.backward()
+        print(f"w.grad: {w._grad}, b.grad: {b._grad}")
 
-    # Update parameters (gradient descent)
-    lr = 0.01
-    w.update(lr)
-    b.update(lr)
+        # Update parameters (gradient descent, in place)
+        optimizer.step()
 
     print(f"Updated weight: {w}, Updated bias: {b}")
@@ -0,0 +1,193 @@
+"""Parse expression strings into nodes.
+
+    sin(x)^2 + e^(2*x) / ln(x)       x or X is the input, other names are Variables
+    Tan(x - 1) * 3.5e-2              composites by name, e.g. tan, Log10, square
+    [(sin(X) + 1) of (X ^ 2)]        Composite(f, g), as printed by repr()
+
+^ (or **) binds tightest and is right associative; a constant exponent gives a
+PolynomialExponent, anything else an FToTheG, and e^f an EToTheF. e, pi, inf and nan
+are constants. The repr() of every node parses back to an expression with the same
+values, and to the same node except for Polynomials (read back as sums of powers),
+FToTheGs with a constant exponent (read back as PolynomialExponents) and Coefficients,
+which print as their bare name and so read back as Variables.
+
+Whole strings and every bracketed group are looked up in parse_cache by their source
+text, so a subexpression string that has been seen before is not parsed again.
+"""
+import keyword
+import re
+
+from modules import *
+from extra import *
+
+# one alternation per token kind; whitespace is skipped by the leading \s*
+TOKEN = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)|(\*\*|[-+*/^()\[\]]))")
+
+FUNCTIONS = {"sin": Sin, "cos": Cos, "ln": Ln, "log": Ln, "exp": EToTheF, "derivative": Derivative}
+
+CONSTANTS = {"e": math.e, "pi": math.pi, "inf": math.inf, "nan": math.nan}
+
+# source text -> node, for whole strings and every bracketed group
+parse_cache = LRUCache()
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _function(name: str):
+    if name in FUNCTIONS:
+        return FUNCTIONS[name]
+    if name in composites:
+        return composites[name]
+    for composite, cls in composites.items(): # tan -> Tan
+        if composite.lower() == name.lower():
+            return cls
+    return None
+
+
+def tokenize(text: str) -> list:
+    """(kind, text, start, end) tokens, kind being "number", "name" or "op"."""
+    tokens = []
+    pos, end = 0, len(text.rstrip())
+    while pos < end:
+        match = TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ParseError(f"unexpected character {text[pos:].lstrip()[:1]!r} at {pos}")
+        kind = match.lastindex
+        tokens.append((("number", "name", "op")[kind - 1], match.group(kind), match.start(kind), match.end()))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+        # index of the matching closing bracket for every opening one
+        self.match = {}
+        stack = []
+        for i, (kind, token, start, _) in enumerate(self.tokens):
+            if kind == "op" and token in "([":
+                stack.append(i)
+            elif kind == "op" and token in ")]":
+                if not stack or self.tokens[stack[-1]][1] != {")": "(", "]": "["}[token]:
+                    raise ParseError(f"unbalanced {token!r} at {start}")
+                self.match[stack.pop()] = i
+        if stack:
+            raise ParseError(f"unclosed {self.tokens[stack[-1]][1]!r} at {self.tokens[stack[-1]][2]}")
+
+    def peek(self):
+        return self.tokens[self.i][1] if self.i < len(self.tokens) else None
+
+    def where(self) -> int:
+        return self.tokens[self.i][2] if self.i < len(self.tokens) else len(self.text)
+
+    def expect(self, token: str) -> None:
+        if self.peek() != token:
+            raise ParseError(f"expected {token!r} at {self.where()}")
+        self.i += 1
+
+    def parse(self) -> Expression:
+        if not self.tokens:
+            raise ParseError("empty expression")
+        expr = self.sum()
+        if self.i != len(self.tokens):
+            raise ParseError(f"unexpected {self.peek()!r} at {self.where()}")
+        return expr
+
+    def sum(self) -> Expression:
+        expr = self.product()
+        while self.peek() in ("+", "-"):
+            op = self.peek()
+            self.i += 1
+            expr = (Add if op == "+" else Subtract)(expr, self.product())
+        return expr
+
+    def product(self) -> Expression:
+        expr = self.unary()
+        while self.peek() in ("*", "/"):
+            op = self.peek()
+            self.i += 1
+            expr = (Multiply if op == "*" else Divide)(expr, self.unary())
+        return expr
+
+    def unary(self) -> Expression:
+        if self.peek() == "-":
+            self.i += 1
+            operand = self.unary()
+            if isinstance(operand, Constant):
+                return Constant(-operand.k)
+            return Multiply(Constant(-1), operand)
+        if self.peek() == "+":
+            self.i += 1
+            return self.unary()
+        return self.power()
+
+    def power(self) -> Expression:
+        is_e = self.i < len(self.tokens) and self.tokens[self.i][:2] == ("name", "e")
+        base = self.primary()
+        if self.peek() not in ("^", "**"):
+            return base
+        self.i += 1
+        exponent = self.unary() # right associative, and x ^ -2 is allowed
+        if is_e:
+            return EToTheF(exponent)
+        if isinstance(exponent, Constant):
+            return PolynomialExponent(exponent, base)
+        return FToTheG(base, exponent)
+
+    def group(self) -> Expression:
+        # the bracketed text from here to the matching ")" or "]", parsed once per distinct string
+        start, close = self.i, self.match[self.i]
+        source = self.text[self.tokens[start][2]:self.tokens[close][3]]
+        expr = parse_cache.get(source)
+        if expr is None:
+            self.i += 1
+            expr = self.composite() if self.tokens[start][1] == "[" else self.sum()
+            if self.i != close:
+                raise ParseError(f"unexpected {self.peek()!r} at {self.where()}")
+            parse_cache[source] = expr
+        self.i = close + 1
+        return expr
+
+    def composite(self) -> Expression:
+        f = self.sum()
+        self.expect("of")
+        return Composite(f, self.sum())
+
+    def primary(self) -> Expression:
+        if self.i >= len(self.tokens):
+            raise ParseError("unexpected end of expression")
+        kind, token, start, _ = self.tokens[self.i]
+        if kind == "number":
+            self.i += 1
+            return Constant(float(token) if any(c in token for c in ".eE") else int(token))
+        if kind == "name":
+            self.i += 1
+            if self.peek() == "(":
+                function = _function(token)
+                if function is None:
+                    raise ParseError(f"unknown function {token!r} at {start}")
+                return function(self.group())
+            if token in ("x", "X"):
+                return X()
+            if token in CONSTANTS:
+                return Constant(CONSTANTS[token])
+            if keyword.iskeyword(token):
+                raise ParseError(f"unexpected {token!r} at {start}")
+            return Variable(token)
+        if token in ("(", "["):
+            return self.group()
+        raise ParseError(f"unexpected {token!r} at {start}")
+
+
+def parse(text: str) -> Expression:
+    """The expression a string describes; raises ParseError if it isn't one."""
+    expr = parse_cache.get(text)
+    if expr is None:
+        expr = _Parser(text).parse()
+        parse_cache[text] = expr
+    return expr
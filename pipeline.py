@@ -0,0 +1,114 @@
+"""Stream differentiate/simplify/evaluate jobs from a JSON lines file.
+
+    python pipeline.py [jobs.jsonl] [--output results.jsonl] [--chunksize 1000] [--processes 4]
+
+Each input line is one job; expressions use the parse module's syntax:
+
+    {"id": 1, "expr": "sin(x)^2", "op": "derivative", "order": 2}
+    {"id": 2, "expr": "tan(x)", "op": "simplify"}
+    {"id": 3, "expr": "a*x^3", "op": "evaluate", "points": [0.5, 1], "variables": {"a": 2}, "order": 1}
+
+and gets one output line, in input order: {"id": ..., "result": ...}, or {"id": ...,
+"error": ...} if it failed. Input is read a chunk at a time and only a couple of chunks
+per process are in flight, so memory stays bounded however big the file is, and each
+chunk's results are written as soon as it and the ones before it are done.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from modules import *
+from compositions import *
+from parse import parse
+
+
+def process(job: dict):
+    """The result of one job: an expression string, or a list of values for "evaluate"."""
+    return process_expression(parse(job["expr"]), job)
+
+
+def process_expression(expr: Expression, job: dict):
+    """process(job) with job["expr"] already parsed into expr."""
+    op = job.get("op", "derivative")
+    order = job.get("order", 1 if op == "derivative" else 0)
+    if op == "derivative":
+        return repr(nth_derivative(expr, order))
+    if op == "simplify":
+        return repr(expr.simplify())
+    if op == "evaluate":
+        points = np.asarray(job["points"], dtype=float)
+        # Taylor mode, so high orders don't build derivative trees
+        return expr.derivatives(points, order, **job.get("variables", {}))[order].tolist()
+    raise ValueError(f"unknown op {op!r}")
+
+
+def _process_chunk(chunk: list) -> list:
+    results = []
+    for number, line in chunk:
+        if not line.strip():
+            continue
+        job = {}
+        try:
+            job = json.loads(line)
+            results.append({"id": job.get("id", number), "result": process(job)})
+        except Exception as error: # one bad job shouldn't take down the rest of the file
+            results.append({"id": job.get("id", number) if isinstance(job, dict) else number,
+                            "error": f"{type(error).__name__}: {error}"})
+    return results
+
+
+def run(lines, chunksize: int = 1000, processes: int = None):
+    """Yield a result dict for every job line, in order, reading lines only as needed.
+
+    processes defaults to the number of cores; with 1 everything runs in this process.
+    """
+    processes = processes or os.cpu_count() or 1
+    numbered = enumerate(lines, start=1)
+    chunks = iter(lambda: list(itertools.islice(numbered, chunksize)), [])
+    if processes == 1:
+        for chunk in chunks:
+            yield from _process_chunk(chunk)
+        return
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_process_chunk, chunk))
+            if len(pending) >= 2 * processes: # backpressure: stop reading until the oldest is done
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", help="JSON lines job file (default: stdin)")
+    parser.add_argument("--output", "-o", help="results file (default: stdout)")
+    parser.add_argument("--chunksize", type=int, default=1000, help="jobs per chunk")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    source = open(args.input) if args.input else sys.stdin
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        written = 0
+        for result in run(source, args.chunksize, args.processes):
+            out.write(json.dumps(result) + "\n")
+            written += 1
+            if written % args.chunksize == 0:
+                out.flush()
+        out.flush()
+    finally:
+        if args.input:
+            source.close()
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
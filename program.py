@@ -0,0 +1,528 @@
+import functools
+import heapq
+import math
+import operator
+import numpy as np
+
+# Source templates for each opcode; operands are substituted positionally.
+OPS = {
+    "add": "{0} + {1}",
+    "sub": "{0} - {1}",
+    "mul": "{0} * {1}",
+    "div": "{0} / {1}",
+    "pow": "{0} ** {1}",
+    "exp": "exp({0})",
+    "log": "log({0})",
+    "sin": "sin({0})",
+    "cos": "cos({0})",
+    "call": "{node}({0})",
+    "kernel": "{node}({0})",
+    "coef": "{node}.value",
+}
+
+MATH = {"exp": math.exp, "log": math.log, "sin": math.sin, "cos": math.cos}
+
+SCALAR = {"add": operator.add, "sub": operator.sub, "mul": operator.mul, "div": operator.truediv,
+          "pow": operator.pow, **MATH}
+
+UFUNCS = {"add": np.add, "sub": np.subtract, "mul": np.multiply, "div": np.divide, "pow": np.power,
+          "exp": np.exp, "log": np.log, "sin": np.sin, "cos": np.cos}
+
+
+def _sum(*terms):
+    # tangents are None where they are known to be zero, so constants cost nothing
+    terms = [t for t in terms if t is not None]
+    if not terms:
+        return None
+    total = terms[0]
+    for t in terms[1:]:
+        total = total + t
+    return total
+
+
+def _dual_div(ops, a, b, da, db):
+    q = a / b
+    return q, _sum(None if da is None else da / b, None if db is None else -q * db / b)
+
+
+def _dual_pow(ops, a, b, da, db):
+    v = ops["pow"](a, b)
+    return v, _sum(None if da is None else b * ops["pow"](a, b - 1) * da,
+                   None if db is None else v * ops["log"](a) * db)
+
+
+def _dual_exp(ops, a, da):
+    v = ops["exp"](a)
+    return v, None if da is None else v * da
+
+
+# Forward-mode rules: (ops, operand values, operand tangents) -> (value, tangent)
+DUAL = {
+    "add": lambda ops, a, b, da, db: (a + b, _sum(da, db)),
+    "sub": lambda ops, a, b, da, db: (a - b, _sum(da, None if db is None else -db)),
+    "mul": lambda ops, a, b, da, db: (a * b, _sum(None if da is None else da * b, None if db is None else a * db)),
+    "div": _dual_div,
+    "pow": _dual_pow,
+    "exp": _dual_exp,
+    "log": lambda ops, a, da: (ops["log"](a), None if da is None else da / a),
+    "sin": lambda ops, a, da: (ops["sin"](a), None if da is None else ops["cos"](a) * da),
+    "cos": lambda ops, a, da: (ops["cos"](a), None if da is None else -ops["sin"](a) * da),
+}
+
+
+def _adjoint_pow(ops, g, v, need, a, b):
+    return (g * b * ops["pow"](a, b - 1) if need[0] else None,
+            g * v * ops["log"](a) if need[1] else None) # log(a) only when the exponent varies
+
+
+# Reverse-mode rules: (ops, output adjoint, output value, which operands need one,
+# operand values) -> adjoint contribution for each operand
+ADJOINT = {
+    "add": lambda ops, g, v, need, a, b: (g, g),
+    "sub": lambda ops, g, v, need, a, b: (g, -g),
+    "mul": lambda ops, g, v, need, a, b: (g * b, g * a),
+    "div": lambda ops, g, v, need, a, b: (g / b, -g * v / b),
+    "pow": _adjoint_pow,
+    "exp": lambda ops, g, v, need, a: (g * v,),
+    "log": lambda ops, g, v, need, a: (g / a,),
+    "sin": lambda ops, g, v, need, a: (g * ops["cos"](a),),
+    "cos": lambda ops, g, v, need, a: (-g * ops["sin"](a),),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _program(expr):
+    # the lowered func or closed-form derivative of a composite kernel, built once
+    return Program(expr)
+
+
+def _call(node, x):
+    # opaque nodes can only be evaluated one point at a time
+    if isinstance(x, np.ndarray):
+        return np.vectorize(node, otypes=[float])(x)
+    return node(x)
+
+
+# Truncated Taylor arithmetic. A series is an array of shape (order + 1, *batch) whose
+# n-th row is the n-th Taylor coefficient f^(n)(x) / n!; every rule is O(order^2).
+
+def _weights(n: int, series: np.ndarray) -> np.ndarray:
+    # 1..n, shaped to broadcast against a series' rows
+    return np.arange(1, n + 1).reshape((n,) + (1,) * (series.ndim - 1))
+
+
+def _series_mul(a, b):
+    out = np.empty(a.shape)
+    for n in range(len(out)):
+        out[n] = (a[:n + 1] * b[n::-1]).sum(axis=0)
+    return out
+
+
+def _series_div(a, b):
+    q = np.empty(a.shape)
+    for n in range(len(q)):
+        q[n] = (a[n] - (q[:n] * b[n:0:-1]).sum(axis=0)) / b[0]
+    return q
+
+
+def _series_exp(a):
+    e = np.empty(a.shape)
+    e[0] = np.exp(a[0])
+    for n in range(1, len(e)):
+        e[n] = (_weights(n, a) * a[1:n + 1] * e[n - 1::-1]).sum(axis=0) / n
+    return e
+
+
+def _series_log(a):
+    l = np.empty(a.shape)
+    l[0] = np.log(a[0])
+    for n in range(1, len(l)):
+        l[n] = (a[n] - (_weights(n - 1, a) * l[1:n] * a[n - 1:0:-1]).sum(axis=0) / n) / a[0]
+    return l
+
+
+def _series_sincos(a):
+    s, c = np.empty(a.shape), np.empty(a.shape)
+    s[0], c[0] = np.sin(a[0]), np.cos(a[0])
+    for n in range(1, len(s)):
+        w = _weights(n, a) * a[1:n + 1]
+        s[n] = (w * c[n - 1::-1]).sum(axis=0) / n
+        c[n] = -(w * s[n - 1::-1]).sum(axis=0) / n
+    return s, c
+
+
+def _series_pow(a, b):
+    if b[1:].any(): # varying exponent
+        return _series_exp(_series_mul(b, _series_log(a)))
+    r = b[0]
+    if np.ndim(r) == 0 and r >= 0 and r == int(r):
+        # repeated squaring, which unlike the recurrence below is fine where a(x) = 0
+        result, base, r = np.zeros(a.shape), a, int(r)
+        result[0] = 1.0
+        while r:
+            if r & 1:
+                result = _series_mul(result, base)
+            r >>= 1
+            if r:
+                base = _series_mul(base, base)
+        return result
+    # a p' = r a' p, solved for each coefficient of p = a^r in turn
+    p = np.empty(a.shape)
+    p[0] = a[0] ** r
+    for n in range(1, len(p)):
+        i = _weights(n, a)
+        p[n] = ((r * i - (n - i)) * a[1:n + 1] * p[n - 1::-1]).sum(axis=0) / (n * a[0])
+    return p
+
+
+def _series_call(node, a):
+    # an opaque node: f(a) = sum f^(j)(a0) / j! (a - a0)^j, with its derivatives taken symbolically
+    out = np.zeros(a.shape)
+    shifted = a.copy()
+    shifted[0] = 0.0
+    term = np.zeros(a.shape)
+    term[0] = 1.0
+    for j in range(len(a)):
+        out += _call(node, a[0]) / math.factorial(j) * term
+        term = _series_mul(term, shifted)
+        node = node.derivative()
+    return out
+
+
+TAYLOR = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "mul": _series_mul,
+    "div": _series_div,
+    "pow": _series_pow,
+    "exp": _series_exp,
+    "log": _series_log,
+    "sin": lambda a: _series_sincos(a)[0],
+    "cos": lambda a: _series_sincos(a)[1],
+}
+
+
+def _is_array(x, env: dict = None) -> bool:
+    # arrays can come in through x or through any variable's value
+    return isinstance(x, np.ndarray) or any(isinstance(v, np.ndarray) for v in (env or {}).values())
+
+
+def _variable(env: dict, name: str):
+    try:
+        return env[name]
+    except (TypeError, KeyError):
+        raise ValueError(f"no value given for variable {name}") from None
+
+
+def _value_key(value):
+    if isinstance(value, (float, np.floating)) and value == 0.0: # keep 0.0 and -0.0 apart
+        return (type(value), value, math.copysign(1.0, value))
+    return (type(value), value)
+
+
+class Program:
+    """An Expression lowered to a flat list of register instructions.
+
+    Register 0 holds the input x, "var" instructions read named variables, "coef" ones
+    the current value of a Coefficient, and every other register is written exactly
+    once by one (op, args, value) instruction, in order. Instructions are value-numbered:
+    emitting an (op, args, value) that already exists returns the existing register, so
+    structurally equal subexpressions are computed once per evaluation.
+    """
+
+    def __init__(self, expr=None) -> None:
+        self.instructions = [("x", (), None)]
+        self._memo = {}
+        self._numbering = {}
+        if expr is not None:
+            self.output = self.lower(expr, 0)
+
+    def lower(self, expr, x: int) -> int:
+        # a node reached twice (shared subtree) with the same input is only lowered once
+        key = (id(expr), x)
+        if key not in self._memo:
+            self._memo[key] = expr._lower(self, x)
+        return self._memo[key]
+
+    def emit(self, op: str, *args: int, value=None) -> int:
+        key = (op, args, _value_key(value))
+        if key not in self._numbering:
+            self.instructions.append((op, args, value))
+            self._numbering[key] = len(self.instructions) - 1
+        return self._numbering[key]
+
+    def const(self, k) -> int:
+        return self.emit("const", value=k)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    @property
+    def variables(self) -> list:
+        return [value for op, _, value in self.instructions if op == "var"]
+
+    def run(self, x, env: dict = None):
+        """Evaluate at a float or over a whole array, computing each register once.
+
+        env maps the names of any Variables in the expression to their values.
+        """
+        if _is_array(x, env):
+            return self._run_array(x, env)
+        return self._values(x, env)[self.output]
+
+    def _values(self, x, env: dict = None) -> list:
+        ops = UFUNCS if _is_array(x, env) else SCALAR
+        values = [x]
+        for op, args, value in self.instructions[1:]:
+            if op == "const":
+                values.append(value)
+            elif op == "var":
+                values.append(_variable(env, value))
+            elif op == "coef":
+                values.append(value.value)
+            elif op == "call":
+                values.append(_call(value, values[args[0]]))
+            elif op == "kernel":
+                values.append(value.kernel(values[args[0]]))
+            else:
+                values.append(ops[op](*(values[a] for a in args)))
+        return values
+
+    def gradients(self, x, env: dict = None, outputs: list = None) -> list:
+        """Value and gradient of each output register, one reverse sweep per output.
+
+        Each gradient maps "x" and every variable and coefficient name to the partial
+        derivative (0.0 if the output doesn't depend on it), so an n-input gradient
+        costs one forward and one backward pass rather than n.
+        """
+        ops = UFUNCS if _is_array(x, env) else SCALAR
+        values = self._values(x, env)
+        # registers that depend on an input; only these need adjoints
+        active = self._active()
+
+        results = []
+        for output in (outputs if outputs is not None else [self.output]):
+            adjoints = [None] * len(self.instructions)
+            adjoints[output] = 1.0
+            for i in range(output, 0, -1):
+                g = adjoints[i]
+                op, args, value = self.instructions[i]
+                if g is None or op in ("const", "var", "coef"):
+                    continue
+                operands = [values[a] for a in args]
+                if op == "call":
+                    contributions = (g * _call(value.derivative(), operands[0]),)
+                elif op == "kernel":
+                    contributions = (g * _program(value.outer_derivative()).run(operands[0]),)
+                else:
+                    need = [active[a] for a in args]
+                    contributions = ADJOINT[op](ops, g, values[i], need, *operands)
+                for a, contribution in zip(args, contributions):
+                    if active[a] and contribution is not None:
+                        adjoints[a] = contribution if adjoints[a] is None else adjoints[a] + contribution
+            gradient = {"x": 0.0 if adjoints[0] is None else adjoints[0]}
+            for i, (op, _, name) in enumerate(self.instructions):
+                if op in ("var", "coef"):
+                    name = name if op == "var" else name.name
+                    gradient[name] = 0.0 if adjoints[i] is None else adjoints[i]
+            results.append((values[output], gradient))
+        return results
+
+    def _active(self) -> list:
+        active = []
+        for op, args, _ in self.instructions:
+            active.append(op in ("x", "var", "coef") or any(active[a] for a in args))
+        return active
+
+    def run_dual(self, x, env: dict = None):
+        """(f(x), f'(x)) in one forward sweep with dual numbers, at a float or an array.
+
+        The derivative, d/dx with any Variables in env held constant, comes back as None
+        when it is identically zero.
+        """
+        ops = UFUNCS if _is_array(x, env) else SCALAR
+        values, tangents = [x], [1.0]
+        for op, args, value in self.instructions[1:]:
+            if op in ("const", "var", "coef"):
+                values.append(value if op == "const" else _variable(env, value) if op == "var" else value.value)
+                tangents.append(None)
+            elif op == "call":
+                a, da = values[args[0]], tangents[args[0]]
+                values.append(_call(value, a))
+                tangents.append(None if da is None else _call(value.derivative(), a) * da)
+            elif op == "kernel":
+                a, da = values[args[0]], tangents[args[0]]
+                values.append(value.kernel(a))
+                tangents.append(None if da is None else _program(value.outer_derivative()).run(a) * da)
+            else:
+                v, dv = DUAL[op](ops, *(values[a] for a in args), *(tangents[a] for a in args))
+                values.append(v)
+                tangents.append(dv)
+        return values[self.output], tangents[self.output]
+
+    def run_taylor(self, x, order: int, env: dict = None) -> np.ndarray:
+        """Taylor coefficients f^(n)(x) / n! for n = 0..order, in one forward sweep.
+
+        Returns an array of shape (order + 1, *batch shape). Variables are held constant.
+        """
+        env = env or {}
+        batch = np.broadcast_shapes(np.shape(x), *(np.shape(v) for v in env.values()))
+        s = np.zeros((order + 1,) + batch)
+        s[0] = x
+        if order:
+            s[1] = 1.0
+        return self._run_series(s, env)
+
+    def _run_series(self, x: np.ndarray, env: dict) -> np.ndarray:
+        # run_taylor with the input already a series, as for a composite's argument
+        def series(value):
+            s = np.zeros(x.shape)
+            s[0] = value
+            return s
+
+        values = [x]
+        for op, args, value in self.instructions[1:]:
+            if op == "const":
+                values.append(series(float(value)))
+            elif op == "var":
+                values.append(series(_variable(env, value)))
+            elif op == "coef":
+                values.append(series(value.value))
+            elif op == "call":
+                values.append(_series_call(value, values[args[0]]))
+            elif op == "kernel":
+                values.append(_program(value.func)._run_series(values[args[0]], {}))
+            else:
+                values.append(TAYLOR[op](*(values[a] for a in args)))
+        return values[self.output]
+
+    def _run_array(self, x: np.ndarray, env: dict = None):
+        last_use = [0] * len(self.instructions)
+        for i, (_, args, _) in enumerate(self.instructions):
+            for a in args:
+                last_use[a] = i
+        last_use[self.output] = len(self.instructions)
+
+        values = [x]
+        for i, (op, args, value) in enumerate(self.instructions[1:], start=1):
+            if op == "const":
+                values.append(float(value))
+                continue
+            if op in ("var", "coef"):
+                values.append(_variable(env, value) if op == "var" else value.value)
+                continue
+            operands = [values[a] for a in args]
+            if op == "call":
+                values.append(_call(value, operands[0]))
+            elif op == "kernel":
+                values.append(value.kernel(operands[0]))
+            else:
+                # write into an operand's buffer when this is the last instruction reading it
+                shape = np.broadcast_shapes(*map(np.shape, operands))
+                out = None
+                for a in args:
+                    if a != 0 and last_use[a] == i and self.instructions[a][0] not in ("var", "coef") \
+                            and type(values[a]) is np.ndarray and values[a].shape == shape:
+                        out = values[a]
+                        break
+                values.append(UFUNCS[op](*operands, out=out))
+            for a in args:
+                if a != 0 and last_use[a] == i:
+                    values[a] = None
+        return values[self.output]
+
+    def source(self, name: str = "f"):
+        """Straight-line Python source for this program, plus the globals it needs."""
+        names = ["x"]
+        namespace = dict(MATH)
+        # variables arrive as keywords and are read into v{i}, so no name can shadow a register or helper
+        lines = [f"def {name}(x=None, **env):" if self.variables else f"def {name}(x):"]
+        if self.variables:
+            namespace["variable"] = _variable
+        for i, (op, args, value) in enumerate(self.instructions[1:], start=1):
+            if op == "const":
+                k = float(value)
+                if math.isfinite(k):
+                    names.append(f"({k!r})" if math.copysign(1.0, k) < 0 else repr(k)) # -2.0 ** x is -(2.0 ** x)
+                else:
+                    names.append(f"k{i}")
+                    namespace[f"k{i}"] = k
+                continue
+            if op == "var":
+                lines.append(f"    v{i} = variable(env, {value!r})")
+                names.append(f"v{i}")
+                continue
+            node = f"n{i}"
+            if op in ("call", "coef"):
+                namespace[node] = value
+            elif op == "kernel":
+                namespace[node] = value.kernel
+            lines.append(f"    r{i} = " + OPS[op].format(*(names[a] for a in args), node=node))
+            names.append(f"r{i}")
+        lines.append(f"    return {names[self.output]}")
+        return "\n".join(lines) + "\n", namespace
+
+    def compile(self, name: str = "f"):
+        src, namespace = self.source(name)
+        exec(compile(src, f"<{name}>", "exec"), namespace)
+        return namespace[name]
+
+
+class Incremental:
+    """A program's values at fixed inputs, kept up to date as its Coefficients change.
+
+    Setting a coefficient marks its register; the next value() recomputes just the
+    registers that depend on the changed ones, in program order, and stops along any
+    path where a scalar comes out unchanged. Sweeping one coefficient of a tree costs
+    the path from it to the root, not the whole tree.
+    """
+
+    def __init__(self, program: Program, x, env: dict = None) -> None:
+        self.program = program
+        self.ops = UFUNCS if _is_array(x, env) else SCALAR
+        self.values = program._values(x, env)
+        self.dependents = [[] for _ in program.instructions] # register -> registers reading it
+        self.registers = {} # coefficient -> its register
+        for i, (op, args, value) in enumerate(program.instructions):
+            for a in set(args):
+                self.dependents[a].append(i)
+            if op == "coef":
+                self.registers[value] = i
+                value._watchers.add(self)
+        self._dirty = [] # heap of registers to recompute
+        self.recomputed = 0 # registers recomputed by value() so far
+
+    def _changed(self, coefficient) -> None:
+        heapq.heappush(self._dirty, self.registers[coefficient])
+
+    def update(self, **coefficients) -> None:
+        """Set coefficients by name."""
+        for coefficient in self.registers:
+            if coefficient.name in coefficients:
+                coefficient.value = coefficients[coefficient.name]
+
+    def value(self):
+        values, instructions, dirty = self.values, self.program.instructions, self._dirty
+        last = None
+        while dirty:
+            i = heapq.heappop(dirty)
+            if i == last: # reached from more than one changed operand
+                continue
+            last = i
+            op, args, value = instructions[i]
+            if op == "coef":
+                new = value.value
+            elif op == "call":
+                new = _call(value, values[args[0]])
+            elif op == "kernel":
+                new = value.kernel(values[args[0]])
+            else:
+                new = self.ops[op](*(values[a] for a in args))
+            self.recomputed += 1
+            unchanged = not isinstance(new, np.ndarray) and not isinstance(values[i], np.ndarray) \
+                and new == values[i]
+            values[i] = new
+            if not unchanged:
+                for d in self.dependents[i]:
+                    heapq.heappush(dirty, d)
+        return values[self.program.output]
@@ -0,0 +1,177 @@
+"""An asyncio differentiation service over a Unix socket or localhost TCP.
+
+    python server.py [--unix /tmp/derivative.sock | --port 8765] [--processes 4]
+
+Clients send the JSON job lines described in pipeline and get one JSON line back per
+job, tagged with the job's id, as soon as it is done (so possibly out of order).
+Concurrent derivative/simplify jobs for the same expression share one computation, and
+finished ones are kept in an LRU cache; evaluate jobs for the same expression that
+arrive within batch_window seconds of each other are concatenated into one array
+evaluation. All of the actual work, parsing included, runs in a process pool, off the
+event loop; expressions go to the workers as store.dumps() bytes, as in batch.
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from modules import *
+from compositions import *
+from parse import parse
+import pipeline
+import store
+
+
+def _parse(text: str) -> bytes:
+    return store.dumps(parse(text))
+
+
+def _process(payload: bytes, job: dict):
+    # repr() doesn't round-trip every node exactly; the store format does
+    return pipeline.process_expression(store.loads(payload), job)
+
+
+class Service:
+
+    def __init__(self, executor=None, batch_window: float = 0.002, max_batch: int = 65536,
+                 cache_size: int = 4096) -> None:
+        self.executor = executor or ProcessPoolExecutor()
+        self.batch_window = batch_window
+        self.max_batch = max_batch # points per evaluation batch
+        self.results = LRUCache(cache_size)
+        self._parsed = LRUCache(cache_size) # source text -> (expr, store.dumps(expr))
+        self._inflight = {}  # (op, expr, order) -> future of the one running computation
+        self._batches = {}   # (expr, order, variables) -> (payload, [(points, future), ...]) waiting to run
+        self._tasks = set()  # running batches, referenced until done so they aren't collected
+        self.computations = 0 # jobs actually sent to the executor
+
+    async def _run(self, payload: bytes, job: dict):
+        self.computations += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, _process, payload, job)
+
+    async def _expression(self, text: str):
+        parsed = self._parsed.get(text)
+        if parsed is None:
+            payload = await asyncio.get_running_loop().run_in_executor(self.executor, _parse, text)
+            parsed = self._parsed[text] = (store.loads(payload), payload)
+        return parsed
+
+    async def submit(self, job: dict):
+        """The result pipeline.process(job) would give, sharing work with concurrent jobs."""
+        op = job.get("op", "derivative")
+        # interned, so equal expressions get equal keys however they're spelled
+        expr, payload = await self._expression(job["expr"])
+        order = job.get("order", 1 if op == "derivative" else 0)
+        if op in ("derivative", "simplify"):
+            return await self._symbolic(op, expr, payload, order)
+        if op == "evaluate":
+            return await self._evaluate(expr, payload, order, job.get("variables", {}), job["points"])
+        raise ValueError(f"unknown op {op!r}")
+
+    async def _symbolic(self, op: str, expr: Expression, payload: bytes, order: int):
+        key = (op, expr, order)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        if key not in self._inflight:
+            future = asyncio.ensure_future(self._run(payload, {"op": op, "order": order}))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        result = await asyncio.shield(self._inflight[key]) # one client giving up doesn't cancel the others
+        self.results[key] = result
+        return result
+
+    async def _evaluate(self, expr: Expression, payload: bytes, order: int, variables: dict, points):
+        points = np.asarray(points, dtype=float)
+        if any(np.ndim(v) for v in variables.values()) or points.ndim > 1:
+            # only flat point lists with scalar variables can be concatenated
+            return await self._run(payload, {"op": "evaluate", "order": order,
+                                             "points": points.tolist(), "variables": variables})
+        key = (expr, order, tuple(sorted(variables.items())))
+        future = asyncio.get_running_loop().create_future()
+        if key not in self._batches:
+            self._batches[key] = (payload, [])
+            asyncio.get_running_loop().call_later(self.batch_window, self._flush, key)
+        batch = self._batches[key][1]
+        batch.append((np.atleast_1d(points), future))
+        if sum(len(p) for p, _ in batch) >= self.max_batch:
+            self._flush(key)
+        values = await future
+        return values if points.ndim else values[0]
+
+    def _flush(self, key) -> None:
+        payload, batch = self._batches.pop(key, (None, None))
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(key, payload, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, key, payload: bytes, batch: list) -> None:
+        expr, order, variables = key
+        job = {"op": "evaluate", "order": order, "variables": dict(variables),
+               "points": np.concatenate([points for points, _ in batch]).tolist()}
+        try:
+            values = await self._run(payload, job)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for points, future in batch:
+            if not future.done():
+                future.set_result(values[start:start + len(points)])
+            start += len(points)
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        job = {}
+        try:
+            job = json.loads(line)
+            response = {"id": job.get("id"), "result": await self.submit(job)}
+        except Exception as error:
+            response = {"id": job.get("id") if isinstance(job, dict) else None,
+                        "error": f"{type(error).__name__}: {error}"}
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # every job on a connection runs concurrently; answers go back as they finish
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.ensure_future(self._answer(line, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+
+async def serve(path: str = None, host: str = "127.0.0.1", port: int = 8765, service: Service = None):
+    """Start serving on a Unix socket at path, or on host:port; returns the asyncio server."""
+    service = service or Service()
+    if path is not None:
+        return await asyncio.start_unix_server(service.handle, path=path)
+    return await asyncio.start_server(service.handle, host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--unix", help="Unix socket path (default: TCP on localhost)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    async def run():
+        server = await serve(args.unix, port=args.port, service=Service(ProcessPoolExecutor(args.processes)))
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
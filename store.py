@@ -0,0 +1,238 @@
+"""Compact binary serialization of expression DAGs, and a disk cache built on it.
+
+Layout (little-endian):
+
+    header     "DRV1", node count, constant count, name count, root index (u32 each)
+    names      u16 length + UTF-8 string: the class name of each node kind used (the
+               opcode table) and the name of each Variable
+    nodes      int32 (op, a, b) per distinct node, children before parents; a and b
+               are child indices (-1 if unused), for a Constant the index into the
+               constant pool and whether it was an int, for a Variable its name's index,
+               for a Coefficient its name's index and its current value's constant
+               (-1 in the bytes structural_hash() reads, the value not being structure),
+               for a Polynomial the start of its (exponent, coefficient) pairs in the
+               constant pool and how many there are
+    constants  float64 constant pool
+
+The node and constant arrays are 8-byte aligned so load() can view them straight out
+of an mmap. Nodes are deduplicated structurally, so equal expressions always encode
+to the same bytes and structural_hash() is stable across processes. Loading a
+Coefficient that already exists in this process leaves its value alone.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from modules import *
+from modules import _coefficient
+from extra import *
+
+MAGIC = b"DRV1"
+HEADER = struct.Struct("<4sIIII")
+NODE_DTYPE = np.dtype([("op", "<i4"), ("a", "<i4"), ("b", "<i4")])
+
+NODE_TYPES = {cls.__name__: cls for cls in (X, Variable, Coefficient, Constant, Polynomial, Add, Subtract, Multiply, Divide,
+                                            Composite, Derivative, PolynomialExponent, EToTheF, Ln, FToTheG, Sin, Cos)}
+
+
+def register(cls) -> None:
+    """Make an Expression subclass serializable; its constructor must take its _fields."""
+    NODE_TYPES[cls.__name__] = cls
+
+
+def _node_type(name: str):
+    cls = NODE_TYPES.get(name) or composites.get(name)
+    if cls is None:
+        raise ValueError(f"unknown expression type {name!r}; register() it first")
+    return cls
+
+
+def _pad(n: int) -> int:
+    return -n % 8
+
+
+def _intern_constant(k: float, constants: list, constant_index: dict) -> int:
+    index = constant_index.setdefault((k, math.copysign(1.0, k)), len(constants))
+    if index == len(constants):
+        constants.append(k)
+    return index
+
+
+def _intern_name(name: str, names: list, name_index: dict) -> int:
+    index = name_index.setdefault(name, len(names))
+    if index == len(names):
+        names.append(name)
+    return index
+
+
+def dumps(expr: Expression, values: bool = True) -> bytes:
+    """expr in the layout above; values=False leaves out Coefficients' current values."""
+    names, name_index = [], {}
+    records, numbering = [], {}
+    constants, constant_index = [], {}
+    index = {}  # id(node) -> record
+    stack = [expr]
+    while stack:
+        node = stack[-1]
+        if id(node) in index:
+            stack.pop()
+            continue
+        children = node._children()
+        pending = [child for child in children if id(child) not in index]
+        if pending:
+            stack.extend(reversed(pending))
+            continue
+        stack.pop()
+
+        name = type(node).__name__
+        if _node_type(name) is not type(node):
+            raise ValueError(f"{name} is not the registered class of that name")
+        op = _intern_name(name, names, name_index)
+        if isinstance(node, Variable):
+            record = (op, _intern_name(node.name, names, name_index), -1)
+        elif isinstance(node, Coefficient):
+            record = (op, _intern_name(node.name, names, name_index),
+                      _intern_constant(float(node.value), constants, constant_index) if values else -1)
+        elif isinstance(node, Constant):
+            record = (op, _intern_constant(float(node.k), constants, constant_index), int(isinstance(node.k, int)))
+        elif isinstance(node, Polynomial):
+            record = (op, len(constants), len(node.terms))
+            constants.extend(value for term in node.terms for value in term)
+        else:
+            if len(children) > 2:
+                raise ValueError(f"{name} has more than two children")
+            child = [index[id(c)] for c in children] + [-1, -1]
+            record = (op, child[0], child[1])
+        # structurally equal nodes share one record, so the encoding is canonical
+        index[id(node)] = numbering.setdefault(record, len(records))
+        if index[id(node)] == len(records):
+            records.append(record)
+
+    out = bytearray(HEADER.pack(MAGIC, len(records), len(constants), len(names), index[id(expr)]))
+    for name in names:
+        encoded = name.encode()
+        out += struct.pack("<H", len(encoded)) + encoded
+    out += bytes(_pad(len(out)))
+    out += np.array(records, dtype=NODE_DTYPE).tobytes()
+    out += bytes(_pad(len(out)))
+    out += np.array(constants, dtype="<f8").tobytes()
+    return bytes(out)
+
+
+def loads(buffer) -> Expression:
+    """Rebuild an expression from dumps() output; accepts bytes, memoryview or an mmap."""
+    magic, n_nodes, n_constants, n_names, root = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("not a serialized expression")
+    offset = HEADER.size
+    names = []
+    for _ in range(n_names):
+        (length,) = struct.unpack_from("<H", buffer, offset)
+        names.append(bytes(buffer[offset + 2:offset + 2 + length]).decode())
+        offset += 2 + length
+    offset += _pad(offset)
+    records = np.frombuffer(buffer, dtype=NODE_DTYPE, count=n_nodes, offset=offset)
+    offset += records.nbytes + _pad(records.nbytes)
+    constants = np.frombuffer(buffer, dtype="<f8", count=n_constants, offset=offset)
+
+    types = {}
+    nodes = []
+    for op, a, b in records.tolist():
+        if op not in types:
+            types[op] = _node_type(names[op])
+        cls = types[op]
+        if cls is Variable:
+            nodes.append(Variable(names[a]))
+        elif cls is Coefficient:
+            nodes.append(_coefficient(names[a], float(constants[b]) if b >= 0 else None))
+        elif cls is Constant:
+            k = float(constants[a])
+            nodes.append(Constant(int(k) if b else k))
+        elif cls is Polynomial:
+            pairs = constants[a:a + 2 * b].tolist()
+            nodes.append(Polynomial(zip(pairs[::2], pairs[1::2])))
+        else:
+            nodes.append(cls(*(nodes[i] for i in (a, b)[:len(cls._fields)])))
+    return nodes[root]
+
+
+def dump(expr: Expression, path: str) -> None:
+    # write then rename, so concurrent readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "wb") as f:
+        f.write(dumps(expr))
+    os.replace(tmp, path)
+
+
+def load(path: str) -> Expression:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return loads(buffer)
+
+
+def structural_hash(expr: Expression) -> str:
+    """A hash of the expression's structure that is the same in every process."""
+    return hashlib.sha256(dumps(expr, values=False)).hexdigest()
+
+
+class DiskCache:
+    """derivative() and simplify() results stored on disk, keyed by structural hash.
+
+    Files are evicted least recently used first once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 2 ** 20) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".drv"))
+
+    def _path(self, expr: Expression, op: str) -> str:
+        return os.path.join(self.directory, f"{structural_hash(expr)}.{op}.drv")
+
+    def get(self, expr: Expression, op: str):
+        path = self._path(expr, op)
+        try:
+            result = load(path)
+            os.utime(path) # mark as recently used
+        except FileNotFoundError: # never written, or evicted by another process meanwhile
+            return None
+        return result
+
+    def put(self, expr: Expression, op: str, result: Expression) -> None:
+        path = self._path(expr, op)
+        dump(result, path)
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".drv")),
+                         key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError: # another process got there first
+                pass
+
+    def derivative(self, expr: Expression) -> Expression:
+        result = self.get(expr, "derivative")
+        if result is None:
+            result = expr.derivative()
+            self.put(expr, "derivative", result)
+        return result
+
+    def simplify(self, expr: Expression) -> Expression:
+        result = self.get(expr, "simplify")
+        if result is None:
+            result = expr.simplify()
+            self.put(expr, "simplify", result)
+        return result
@@ -1,8 +1,24 @@
 import unittest
+import gc
 import math
+import numpy as np
 from modules import *
 from extra import *
 from compositions import *
+from program import Program
+import store
+import batch
+import pipeline
+import server
+import asyncio
+import instrument
+from concurrent.futures import ThreadPoolExecutor
+from parse import parse, parse_cache, ParseError
+import tempfile
+import json
+import os
+import io
+import contextlib
 
 class TestExpressionDerivatives(unittest.TestCase):
     
@@ -101,5 +117,754 @@ class TestExpressionDerivatives(unittest.TestCase):
         self.assertAlmostEqual(d(1), 8.0)
         self.assertAlmostEqual(expr.derivative()(2), 14.0)
 
+class TestVectorizedEvaluation(unittest.TestCase):
+
+    def assertMatchesScalar(self, expr, xs):
+        ys = expr.evaluate(xs)
+        self.assertEqual(ys.shape, xs.shape)
+        for x, y in zip(xs, ys):
+            self.assertAlmostEqual(y, expr(x))
+
+    def test_elementary_expressions(self):
+        xs = np.linspace(0.1, 3.0, 25)
+        for expr in [Add(Multiply(Constant(3), X()), Constant(1)), Divide(Constant(1), X()),
+                     Sin(Multiply(Constant(2), X())), Cos(X()), EToTheF(X()), Ln(X()),
+                     PolynomialExponent(Constant(3), X()), FToTheG(X(), Constant(2))]:
+            self.assertMatchesScalar(expr, xs)
+
+    def test_derivative_of_composite(self):
+        xs = np.linspace(-1.0, 1.0, 25)
+        self.assertMatchesScalar(Tan(X()).derivative(), xs)
+        self.assertMatchesScalar(Multiply(Square(X()), EToTheF(Multiply(Constant(2), X()))).derivative(), xs)
+
+    def test_constant_fills_input_shape(self):
+        ys = Constant(5).evaluate(np.zeros((2, 3)))
+        self.assertEqual(ys.shape, (2, 3))
+        self.assertTrue((ys == 5).all())
+
+    def test_input_is_not_overwritten(self):
+        xs = np.linspace(0.0, 1.0, 10)
+        before = xs.copy()
+        X().evaluate(xs)[:] = 0
+        Add(Sin(X()), X()).evaluate(xs)
+        self.assertTrue((xs == before).all())
+
+class TestCompile(unittest.TestCase):
+
+    def test_compiled_matches_tree(self):
+        for expr in [Tan(X()).derivative(), Log10(X()), Divide(Constant(1), X()).derivative(),
+                     FToTheG(X(), X()).derivative(), PolynomialExponent(Constant(3), Sin(X()))]:
+            f = expr.compile()
+            for x in [0.3, 0.7, 1.2]:
+                self.assertAlmostEqual(f(x), expr(x))
+
+    def test_negative_constants_match_tree(self):
+        for expr in [FToTheG(Constant(-2), X()), PolynomialExponent(Constant(-2), X()),
+                     Subtract(Constant(-0.0), X()), Divide(Constant(-1.5), FToTheG(X(), Constant(-1)))]:
+            f = expr.compile()
+            for x in [1.0, 2.0, 3.0]:
+                self.assertEqual(f(x), expr(x), (expr, x))
+
+    def test_constant_expression(self):
+        self.assertEqual(Constant(4).compile()(123.0), 4.0)
+        self.assertEqual(X().compile()(2.5), 2.5)
+
+    def test_shared_subtree_lowered_once(self):
+        shared = Sin(X())
+        prog = Program(Multiply(shared, shared))
+        self.assertEqual([op for op, _, _ in prog.instructions], ["x", "sin", "mul"])
+
+    def test_unknown_node_falls_back_to_call(self):
+        class Half(Expression):
+            def __call__(self, x):
+                return x / 2
+        self.assertAlmostEqual(Add(Half(), X()).compile()(4.0), 6.0)
+
+class TestInterning(unittest.TestCase):
+
+    def test_identical_nodes_are_shared(self):
+        self.assertIs(Add(X(), Constant(1)), Add(X(), Constant(1)))
+        self.assertIs(Sin(X), Sin(X()))
+        self.assertIsNot(Constant(1), Constant(1.0))
+        self.assertIsNot(Constant(0.0), Constant(-0.0))
+        self.assertIsNot(Constant(0.0), Constant(1.0))
+        self.assertEqual(Constant(1.0).k, 1.0)
+
+    def test_derivative_builds_dag(self):
+        d2 = Multiply(Sin(X()), Cos(X())).derivative().derivative()
+        # d(a'b + ab') = (a''b + a'b') + (a'b' + ab''), with the -1 factors folded out of the
+        # a'b' terms: they are still one node
+        self.assertIs(d2.a.b.b, d2.b.b.a)
+
+    def test_numpy_zeros_kept_apart(self):
+        self.assertIsNot(Constant(np.float64(0.0)), Constant(np.float64(-0.0)))
+        self.assertIsNot(Constant(np.float64(0.0)), Constant(0.0))
+        prog = Program(Add(Constant(np.float64(0.0)), Constant(np.float64(-0.0))))
+        self.assertEqual(len(prog.instructions), 4)
+
+    def test_copy_and_pickle_return_the_interned_node(self):
+        import copy, pickle
+        a = Coefficient("a", 2.5)
+        for expr in [X(), Constant(-0.0), Variable("y"), a, Polynomial({0: 1, 3: 2}),
+                     Multiply(Sin(X()), Tan(Constant(2))), Derivative(Ln(X())),
+                     Composite(Cos(X()), Polynomial({2: 1}))]:
+            self.assertIs(copy.copy(expr), expr)
+            self.assertIs(copy.deepcopy(expr), expr)
+            self.assertIs(pickle.loads(pickle.dumps(expr)), expr)
+        self.assertEqual(X()(3.0), 3.0) # the shared X() wasn't overwritten
+        self.assertEqual(a.value, 2.5)
+
+    def test_repeat_construction_skips_init(self):
+        built = []
+        class Twice(Expression):
+            _fields = ("f",)
+            __slots__ = _fields
+            def __init__(self, f):
+                super().__init__()
+                built.append(f)
+                self.f = f
+        node = Twice(X())
+        self.assertIs(Twice(X()), node)
+        self.assertEqual(built, [X()])
+
+    def test_simplify_does_not_mutate(self):
+        inner = Add(Constant(1), Constant(2))
+        expr = Divide(inner, X())
+        expr.simplify()
+        self.assertIs(expr.a, inner)
+
+class TestSimplify(unittest.TestCase):
+
+    def test_unrepresentable_constants_are_left_alone(self):
+        for expr in [EToTheF(Constant(1000)), Sin(Constant(math.inf)), Cos(Constant(-math.inf)),
+                     Ln(Constant(-1)), Ln(Constant(math.inf))]:
+            self.assertIs(expr.simplify(), expr)
+        self.assertIs(Sin(Constant(0.5)).simplify(), Constant(math.sin(0.5)))
+        self.assertEqual(pipeline.process({"expr": "x*e^800", "op": "derivative"}), "(e^800)")
+
+    def test_rules_run_to_fixpoint(self):
+        self.assertIs(Multiply(Add(Constant(0), Constant(1)), X()).simplify(), X())
+        self.assertEqual(Divide(Constant(1), Constant(4)).simplify().k, 0.25)
+        self.assertIs(PolynomialExponent(Constant(2), X()).derivative().simplify(), Polynomial({1: 2}))
+
+    def test_shared_dag_is_visited_once(self):
+        expr = Sin(X()) # not a polynomial, so the sums aren't collected into one term
+        for _ in range(100): # a tree of 2^100 nodes, but only 300 distinct ones
+            expr = Add(Multiply(expr, Constant(1)), expr)
+        simplified = expr.simplify()
+        self.assertIsInstance(simplified, Add)
+        self.assertIs(simplified.a, simplified.b)
+        self.assertAlmostEqual(simplified.compile()(1.0) / 2.0 ** 100, math.sin(1.0))
+
+    def test_deep_tree_does_not_recurse(self):
+        expr = X()
+        for _ in range(5000):
+            expr = Add(expr, Constant(0))
+        self.assertIs(expr.simplify(), X())
+
+class TestSharedEvaluation(unittest.TestCase):
+
+    def test_structurally_equal_subtrees_computed_once(self):
+        # Sin() and Sin(X()) are different objects but the same subexpression
+        prog = Program(Add(Sin(), Sin(X())))
+        self.assertEqual([op for op, _, _ in prog.instructions], ["x", "sin", "add"])
+
+    def test_quotient_rule_evaluates_denominator_once(self):
+        ops = [op for op, _, _ in Program(Divide(Sin(X), Cos(X)).derivative()).instructions]
+        self.assertEqual(ops.count("cos"), 1)
+        self.assertEqual(ops.count("sin"), 1)
+
+    def test_run_scalar_and_array(self):
+        expr = Divide(Sin(X()), Add(Cos(X()), Constant(2))).derivative()
+        prog = Program(expr)
+        xs = np.linspace(-2.0, 2.0, 9)
+        ys = prog.run(xs)
+        for x, y in zip(xs, ys):
+            self.assertAlmostEqual(prog.run(float(x)), expr(x))
+            self.assertAlmostEqual(y, expr(x))
+
+class TestCompactNodes(unittest.TestCase):
+
+    def test_nodes_have_no_instance_dict(self):
+        nodes = [X(), Constant(1), Add(X(), X()), Subtract(X(), X()), Multiply(X(), X()), Divide(X(), X()),
+                 Composite(Sin(X()), X()), Sin(X()), Cos(X()), Ln(X()), EToTheF(X()),
+                 PolynomialExponent(Constant(2), X()), FToTheG(X(), X()), Tan(X()), Log10(X()),
+                 Polynomial({2: 1})]
+        for node in nodes:
+            self.assertFalse(hasattr(node, "__dict__"), type(node).__name__)
+
+class TestForwardMode(unittest.TestCase):
+
+    def test_matches_symbolic_derivative(self):
+        for expr in [Tan(X()), Log10(X()), FToTheG(X(), Sin(X())), Divide(EToTheF(X()), Add(X(), Constant(2))),
+                     PolynomialExponent(Constant(3), Cos(X()))]:
+            for x in [0.3, 0.9]:
+                value, slope = expr.value_and_derivative(x)
+                self.assertAlmostEqual(value, expr(x))
+                self.assertAlmostEqual(slope, expr.derivative()(x))
+
+    def test_arrays(self):
+        expr = Multiply(Sin(X()), EToTheF(Multiply(Constant(2), X())))
+        xs = np.linspace(-1.0, 1.0, 7)
+        values, slopes = expr.value_and_derivative(xs)
+        np.testing.assert_allclose(values, expr.evaluate(xs))
+        np.testing.assert_allclose(slopes, expr.derivative().evaluate(xs))
+
+    def test_constant_has_zero_slope(self):
+        self.assertEqual(Constant(3).value_and_derivative(1.0), (3, 0.0))
+        self.assertTrue((Constant(3).value_and_derivative(np.ones(4))[1] == 0).all())
+
+class TestTaylorMode(unittest.TestCase):
+
+    def test_matches_symbolic_derivatives(self):
+        for expr in [Tan(X()), Log10(X()), FToTheG(X(), Sin(X())), Divide(EToTheF(X()), Add(X(), Constant(2))),
+                     PolynomialExponent(Constant(-2.5), Cos(X())), Polynomial({5: 1, 2: 3})]:
+            d = expr.derivatives(0.7, 4)
+            for n in range(5):
+                expected = nth_derivative(expr, n)(0.7)
+                self.assertAlmostEqual(d[n], expected, delta=1e-9 * (1 + abs(expected)))
+
+    def test_high_order_and_arrays(self):
+        xs = np.linspace(-1.0, 1.0, 5)
+        d = Sin(Multiply(Constant(2), X())).derivatives(xs, 8)
+        self.assertEqual(d.shape, (9, 5))
+        np.testing.assert_allclose(d[8], 2 ** 8 * np.sin(2 * xs), atol=1e-9)
+        np.testing.assert_allclose(d[7], -(2 ** 7) * np.cos(2 * xs), atol=1e-9)
+
+    def test_integer_power_at_zero(self):
+        np.testing.assert_allclose(PolynomialExponent(Constant(3), X()).derivatives(0.0, 4), [0, 0, 0, 6, 0])
+
+    def test_opaque_node(self):
+        class Twice(Expression):
+            def __call__(self, x):
+                return 2 * x
+            def _derivative(self):
+                return Constant(2)
+        np.testing.assert_allclose(EToTheF(Twice()).derivatives(0.5, 3), [math.e * 2 ** n for n in range(4)])
+
+class TestLazyDerivative(unittest.TestCase):
+
+    def test_expands_one_level(self):
+        derivative_cache.clear() # an already differentiated child would be used as is
+        expr = Multiply(Tan(X()), EToTheF(Sin(X())))
+        d = Derivative(expr).expand()
+        self.assertIs(d, Add(Multiply(Derivative(Tan(X())), EToTheF(Sin(X()))), Multiply(Tan(X()), Derivative(EToTheF(Sin(X()))))))
+        self.assertIs(Derivative(expr).expand(), d)
+
+    def test_matches_eager_derivative(self):
+        expr = Divide(FToTheG(X(), Sin(X())), Add(Log10(X()), Constant(3)))
+        xs = np.linspace(0.2, 1.2, 5)
+        np.testing.assert_allclose(Derivative(expr).evaluate(xs), expr.derivative().evaluate(xs))
+        self.assertAlmostEqual(Derivative(expr)(0.5), expr.derivative()(0.5))
+        self.assertIs(Derivative(expr).simplify(), expr.derivative().simplify())
+        self.assertAlmostEqual(Derivative(Derivative(expr)).compile()(0.5), expr.derivative().derivative()(0.5))
+
+    def test_discarded_branch_is_never_expanded(self):
+        lazy = Derivative(Multiply(Sin(X()), Cot(X())))
+        self.assertIs(Multiply(Constant(0), lazy).simplify(), Constant(0.0))
+        self.assertFalse(hasattr(lazy, "_expanded"))
+
+    def test_repr_store_and_parse(self):
+        lazy = Derivative(Sin(X()))
+        self.assertEqual(repr(lazy), "derivative(sin(X))")
+        self.assertIs(parse(repr(lazy)), lazy)
+        self.assertIs(store.loads(store.dumps(lazy)), lazy)
+
+class TestComposites(unittest.TestCase):
+
+    def test_closed_form_derivative(self):
+        inner = Multiply(Constant(2), X())
+        d = Tan(inner).derivative()
+        self.assertIs(d, Multiply(Constant(2.0), Divide(Constant(1), PolynomialExponent(Constant(2), Cos(inner)))))
+        for cls, f, df in [(Tan, np.tan, lambda x: 1 / np.cos(x) ** 2), (Cot, lambda x: 1 / np.tan(x), lambda x: -1 / np.sin(x) ** 2),
+                           (Sec, lambda x: 1 / np.cos(x), lambda x: np.tan(x) / np.cos(x)),
+                           (Csc, lambda x: 1 / np.sin(x), lambda x: -1 / (np.tan(x) * np.sin(x))),
+                           (Inverse, lambda x: 1 / x, lambda x: -1 / x ** 2), (Square, np.square, lambda x: 2 * x),
+                           (Log10, np.log10, lambda x: 1 / (x * math.log(10)))]:
+            self.assertAlmostEqual(cls(X())(0.7), f(0.7))
+            self.assertAlmostEqual(cls(X()).derivative()(0.7), df(0.7))
+            self.assertAlmostEqual(cls(X()).derivative().simplify().compile()(0.7), df(0.7))
+
+    def test_no_printing(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            Sec(Sin(X()))(0.3)
+            Sec(Sin(X())).evaluate(np.linspace(0, 1, 3))
+        self.assertEqual(out.getvalue(), "")
+
+    def test_substitute(self):
+        self.assertIs(substitute(Divide(Sin(X), Cos(X)), Ln(X())), Divide(Sin(Ln(X())), Cos(Ln(X()))))
+        self.assertIs(substitute(Composite(Sin(X), X()), Ln(X())), Composite(Sin(X), Ln(X())))
+        self.assertIs(Tan(Ln(X())).body, Divide(Sin(Ln(X())), Cos(Ln(X()))))
+        self.assertAlmostEqual(substitute(Polynomial({2: 1}), Sin(X()))(0.5), math.sin(0.5) ** 2)
+
+    def test_kernel_in_programs(self):
+        expr = Multiply(Tan(Sin(X())), Log10(X()))
+        self.assertIn("kernel", [op for op, _, _ in Program(expr).instructions])
+        xs = np.linspace(0.2, 1.2, 5)
+        expected = np.tan(np.sin(xs)) * np.log10(xs)
+        np.testing.assert_allclose(expr.evaluate(xs), expected)
+        self.assertAlmostEqual(expr.compile()(0.5), np.tan(np.sin(0.5)) * np.log10(0.5))
+        value, slope = expr.value_and_derivative(xs)
+        np.testing.assert_allclose(slope, expr.derivative().evaluate(xs))
+        self.assertAlmostEqual(expr.value_and_gradient({"x": 0.5})[1]["x"], expr.derivative()(0.5))
+        d = expr.derivatives(0.5, 3)
+        for n in range(4):
+            self.assertAlmostEqual(d[n], nth_derivative(expr, n)(0.5))
+
+class TestFold(unittest.TestCase):
+
+    def test_constant_subtrees_collapse(self):
+        self.assertIs(fold(Add(Sin(Constant(0.5)), Multiply(Constant(2), Ln(Constant(3))))),
+                      Constant(math.sin(0.5) + 2 * math.log(3)))
+        self.assertIs(fold(Composite(Sin(X), Constant(0.5))), Constant(math.sin(0.5)))
+        self.assertIs(fold(Tan(Constant(0.5))), Constant(math.tan(0.5)))
+        self.assertIs(fold(Ln(Constant(-1))), Ln(Constant(-1))) # left for evaluation to report
+        self.assertIs(fold(Multiply(Variable("a"), Constant(1))), Variable("a"))
+
+    def test_complex_powers_are_not_folded(self):
+        cube_root = FToTheG(Constant(-8), Constant(1 / 3))
+        self.assertIs(fold(cube_root), cube_root)
+        self.assertIs(cube_root.simplify(), cube_root)
+        self.assertIs(PolynomialExponent(Constant(0.5), Constant(-4)).simplify(), PolynomialExponent(Constant(0.5), Constant(-4)))
+        self.assertIs(fold(Add(Constant(math.inf), Constant(1))), Add(Constant(math.inf), Constant(1)))
+        with self.assertRaises(ValueError):
+            Constant(-8) ** Constant(1 / 3)
+        with np.errstate(invalid="ignore"):
+            self.assertTrue(np.isnan(Multiply(X(), cube_root).derivative().evaluate([1.0, 2.0])).all())
+
+    def test_identities_and_reassociation(self):
+        self.assertIs(fold(Multiply(Constant(3), Multiply(Constant(-1.0), Sin(X())))), Multiply(Constant(-3.0), Sin(X())))
+        self.assertIs(fold(Multiply(Multiply(Constant(2), X()), Multiply(Constant(0.5), Cos(X())))), Multiply(X(), Cos(X())))
+        self.assertIs(fold(Add(Constant(1), Add(Constant(-1), X()))), X())
+        self.assertIs(fold(Multiply(Constant(0), Sin(X()))), Constant(0.0))
+        self.assertIs(fold(PolynomialExponent(Constant(1), Sin(X()))), Sin(X()))
+        self.assertIs(fold(Divide(Subtract(Sin(X()), Constant(0)), Constant(1))), Sin(X()))
+        self.assertIs(fold(Subtract(Constant(0), Multiply(Constant(2), X()))), Multiply(Constant(-2), X()))
+        self.assertIs(Subtract(Constant(0.0), Sin(X())).simplify(), Multiply(Constant(-1), Sin(X())))
+        d2 = Tan(X()).derivative().derivative()
+        self.assertNotIn("0.0 -", repr(d2))
+        self.assertAlmostEqual(d2(0.7), 2 * math.tan(0.7) / math.cos(0.7) ** 2)
+
+    def test_runs_after_derivative(self):
+        d = PolynomialExponent(Constant(3), Sin(X())).derivative()
+        self.assertIs(d, Multiply(Constant(3), Multiply(Cos(X()), PolynomialExponent(Constant(2), Sin(X())))))
+        self.assertIs(fold(d), d)
+        expr = Multiply(Cos(Multiply(Constant(2), X())), Log10(X()))
+        self.assertAlmostEqual(nth_derivative(expr, 3, simplify=False)(0.7), nth_derivative(expr, 3)(0.7))
+
+class TestDerivativeCache(unittest.TestCase):
+
+    def test_derivative_is_cached(self):
+        expr = Multiply(Sin(X()), Ln(X()))
+        self.assertIs(expr.derivative(), expr.derivative())
+        self.assertIsNotNone(derivative_cache.get(Ln(X()))) # extra.py nodes go through the cache too
+
+    def test_lowered_program_is_reused(self):
+        c = Coefficient("c", 2.0)
+        expr = Multiply(c, Tan(Sin(X())))
+        self.assertEqual(expr.value_and_derivative(0.3)[0], expr(0.3))
+        program = program_cache.get(expr)
+        self.assertIsNotNone(program)
+        expr.evaluate([0.1, 0.2])
+        expr.value_and_gradient({"x": 0.5})
+        self.assertIs(program_cache.get(expr), program)
+        c.value = 3.0 # read when the program runs, not when it was lowered
+        self.assertAlmostEqual(expr.value_and_derivative(0.3)[0], 3.0 * math.tan(math.sin(0.3)))
+
+    def test_nth_derivative_reuses_lower_orders(self):
+        expr = Multiply(EToTheF(Sin(X())), Cos(X()))
+        third = nth_derivative(expr, 3)
+        self.assertIs(nth_derivative(expr, 3), third)
+        self.assertIs(nth_derivative(expr, 2).derivative().simplify(), third)
+        self.assertAlmostEqual(third(0.4), expr.derivative().derivative().derivative()(0.4))
+        self.assertIs(nth_derivative(expr, 0), expr)
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache["a"], cache["b"] = 1, 2
+        cache.get("a")
+        cache["c"] = 3
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+class TestPolynomial(unittest.TestCase):
+
+    def test_forms_are_one_node(self):
+        p = Polynomial({2: 3, 0: 1})
+        self.assertIs(Polynomial([(0, 1.0), (2, 1), (2, 2)]), p)
+        self.assertIs(Polynomial(np.array([1.0, 0.0, 3.0])), p)
+        np.testing.assert_array_equal(p.coefficients(), [1.0, 0.0, 3.0])
+        with self.assertRaises(ValueError):
+            Polynomial({-1: 1})
+
+    def test_horner_evaluation(self):
+        p = Polynomial({40: 1, 3: -2, 0: 5})
+        xs = np.linspace(-1.0, 1.0, 5)
+        expected = xs ** 40 - 2 * xs ** 3 + 5
+        np.testing.assert_allclose(p.evaluate(xs), expected)
+        np.testing.assert_allclose([p(x) for x in xs], expected)
+        np.testing.assert_allclose([p.compile()(x) for x in xs], expected)
+
+    def test_derivative_is_polynomial(self):
+        p = Polynomial({100: 1, 3: 2, 0: 7})
+        self.assertIs(p.derivative(), Polynomial({99: 100, 2: 6}))
+        self.assertIs(Polynomial({0: 7}).derivative().simplify(), Constant(0.0))
+
+    def test_trees_are_collected(self):
+        self.assertIs(Add(Multiply(Constant(2), X()), Multiply(X(), Constant(3))).simplify(), Polynomial({1: 5}))
+        self.assertIs(Subtract(X(), X()).simplify(), Constant(0.0))
+        self.assertIs(PolynomialExponent(Constant(2), Add(X(), Constant(1))).simplify(), Polynomial({2: 1, 1: 2, 0: 1}))
+        self.assertIs(Divide(Add(X(), X()), Constant(4)).simplify(), Polynomial({1: 0.5}))
+        # not a polynomial: left alone
+        self.assertIsInstance(PolynomialExponent(Constant(0.5), X()).simplify(), PolynomialExponent)
+
+    def test_derivatives_shrink(self):
+        expr = PolynomialExponent(Constant(3), Add(PolynomialExponent(Constant(2), X()), Multiply(Constant(3), X())))
+        sizes = [len(nth_derivative(expr, n).terms) for n in range(1, 5)]
+        self.assertEqual(sizes, [4, 4, 4, 3])
+        self.assertAlmostEqual(nth_derivative(expr, 4)(0.7), expr.derivative().derivative().derivative().derivative()(0.7))
+
+    def test_store_round_trip(self):
+        p = Polynomial({2 ** 40: 1.5, 1: -2})
+        self.assertIs(store.loads(store.dumps(Sin(p))), Sin(p))
+
+class TestStore(unittest.TestCase):
+
+    def test_round_trip(self):
+        for expr in [nth_derivative(Tan(X()), 2), Log10(Square(X())), Composite(Sin(X()), Constant(3)),
+                     PolynomialExponent(Constant(-2.5), FToTheG(X(), EToTheF(X())))]:
+            self.assertIs(store.loads(store.dumps(expr)), expr)
+
+    def test_structural_hash_is_canonical(self):
+        self.assertEqual(store.structural_hash(Sin()), store.structural_hash(Sin(X())))
+        self.assertNotEqual(store.structural_hash(Constant(1)), store.structural_hash(Constant(1.0)))
+        self.assertNotEqual(store.structural_hash(Sin(X())), store.structural_hash(Cos(X())))
+
+    def test_load_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "expr.drv")
+            store.dump(Tan(X()).derivative(), path)
+            self.assertIs(store.load(path), Tan(X()).derivative())
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            expr = Multiply(Sin(X()), Cos(X()))
+            cache = store.DiskCache(directory)
+            self.assertIsNone(cache.get(expr, "derivative"))
+            d = cache.derivative(expr)
+            self.assertIs(store.DiskCache(directory).get(expr, "derivative"), d)
+
+            small = store.DiskCache(directory, max_bytes=1)
+            small.simplify(d)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_disk_cache_eviction_race_is_a_miss(self):
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as directory:
+            expr = Sin(X())
+            cache = store.DiskCache(directory)
+            cache.derivative(expr)
+            # another process evicts the file between the read and the utime
+            with mock.patch.object(store.os, "utime", side_effect=FileNotFoundError):
+                self.assertIsNone(cache.get(expr, "derivative"))
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.exprs = [Multiply(Tan(X()), PolynomialExponent(Constant(n), Sin(X()))) for n in range(1, 9)]
+
+    def test_differentiate_in_order(self):
+        for processes in (1, 2):
+            results = batch.differentiate(self.exprs, order=2, processes=processes, chunksize=3)
+            self.assertEqual(len(results), len(self.exprs))
+            for expr, d in zip(self.exprs, results):
+                self.assertIs(d, nth_derivative(expr, 2))
+
+    def test_evaluate_shared_and_per_expression_points(self):
+        xs = np.linspace(0.1, 1.0, 4)
+        for values, expr in zip(batch.evaluate(self.exprs, xs, order=1, processes=2), self.exprs):
+            np.testing.assert_allclose(values, expr.derivative().evaluate(xs))
+        grids = [xs * n for n in range(1, 3)]
+        values = batch.evaluate(self.exprs[:2], grids, processes=1)
+        np.testing.assert_allclose(values[1], self.exprs[1].evaluate(grids[1]))
+
+class TestParse(unittest.TestCase):
+
+    def test_precedence(self):
+        self.assertIs(parse("1 + 2 * x ^ 2"), Add(Constant(1), Multiply(Constant(2), PolynomialExponent(Constant(2), X()))))
+        self.assertIs(parse("-x^2"), Multiply(Constant(-1), PolynomialExponent(Constant(2), X())))
+        self.assertIs(parse("2 ^ x ^ 2"), FToTheG(Constant(2), PolynomialExponent(Constant(2), X())))
+        self.assertIs(parse("e^(2*x) / ln(x)"), Divide(EToTheF(Multiply(Constant(2), X())), Ln(X())))
+        self.assertIs(parse("tan(a) - 1.5e-1"), Subtract(Tan(Variable("a")), Constant(0.15)))
+
+    def test_repr_round_trips(self):
+        xs = np.linspace(0.2, 1.2, 5)
+        for expr in [nth_derivative(Tan(X()), 2), FToTheG(X(), Sin(X())).derivative(), Log10(Square(X())),
+                     PolynomialExponent(Constant(-2.5), EToTheF(EToTheF(X()))), Polynomial({3: 2, 0: -1})]:
+            np.testing.assert_allclose(parse(repr(expr)).evaluate(xs), expr.evaluate(xs))
+
+    def test_every_node_round_trips(self):
+        xs = np.array([1.0, 2.0, 3.0]) # whole numbers, so negative bases stay real
+        a = Variable("a")
+        nodes = [X(), a, Constant(-2), Constant(-0.0), Constant(2.5), Constant(-math.inf),
+                 Add(a, Constant(-1)), Subtract(Constant(-1.5), X()), Multiply(Constant(-1), X()),
+                 Divide(X(), Constant(-4)), PolynomialExponent(Constant(-2), X()),
+                 PolynomialExponent(Constant(3), Constant(-2)), FToTheG(Constant(-2), X()),
+                 FToTheG(Constant(-0.5), Add(X(), Constant(1))), FToTheG(X(), a), EToTheF(Constant(-1)), Ln(X()),
+                 Cos(Multiply(a, X())), Tan(Constant(-1)), Log10(Square(X())), Derivative(Sin(X())),
+                 Composite(Cos(X()), Constant(-3)), FToTheG(X(), Sin(X())).derivative()]
+        for expr in nodes:
+            self.assertIs(parse(repr(expr)), expr, repr(expr))
+            np.testing.assert_allclose(parse(repr(expr)).evaluate(xs, a=0.7), expr.evaluate(xs, a=0.7))
+        polynomial = Polynomial({3: 2, 0: -1}) # comes back as the sum it prints
+        np.testing.assert_allclose(parse(repr(polynomial)).evaluate(xs), polynomial.evaluate(xs))
+        power = FToTheG(X(), Constant(2)) # prints like the PolynomialExponent it comes back as
+        self.assertIs(parse(repr(power)), PolynomialExponent(Constant(2), X()))
+        np.testing.assert_allclose(parse(repr(power)).evaluate(xs), power.evaluate(xs))
+
+    def test_groups_are_cached(self):
+        parse("sin((x + 7) * 2)")
+        self.assertIs(parse_cache.get("(x + 7)"), Add(X(), Constant(7)))
+        self.assertIs(parse("cos(x + 7) + (x + 7)"), Add(Cos(Add(X(), Constant(7))), Add(X(), Constant(7))))
+
+    def test_errors(self):
+        for text in ["", "sin(x", "x +", "foo(x)", "x $ 2", "(x))", "[x of]", "x + if"]:
+            with self.assertRaises(ParseError, msg=text):
+                parse(text)
+
+class TestPipeline(unittest.TestCase):
+
+    def test_jobs_in_order(self):
+        lines = ['{"id": "a", "expr": "x^3", "op": "derivative", "order": 2}',
+                 '',
+                 '{"id": "b", "expr": "x + x", "op": "simplify"}',
+                 '{"expr": "a*sin(x)", "op": "evaluate", "points": [0, 1], "variables": {"a": 2}, "order": 1}',
+                 '{"id": "d", "expr": "sin(x"}',
+                 'not json']
+        for processes in (1, 2):
+            results = list(pipeline.run(lines, chunksize=2, processes=processes))
+            self.assertEqual([r["id"] for r in results], ["a", "b", 4, "d", 6])
+            self.assertIs(parse(results[0]["result"]).simplify(), Polynomial({1: 6}))
+            self.assertEqual(results[1]["result"], repr(Polynomial({1: 2})))
+            np.testing.assert_allclose(results[2]["result"], [2.0, 2 * math.cos(1.0)])
+            self.assertIn("ParseError", results[3]["error"])
+            self.assertIn("error", results[4])
+
+    def test_reads_lazily(self):
+        read = []
+        def lines():
+            for i in range(10):
+                read.append(i)
+                yield '{"expr": "x", "op": "simplify"}'
+        results = pipeline.run(lines(), chunksize=3, processes=1)
+        next(results)
+        self.assertEqual(read, [0, 1, 2])
+
+class TestServer(unittest.TestCase):
+
+    def ask(self, jobs, service):
+        async def client(path, job):
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write((json.dumps(job) + "\n").encode())
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            writer.close()
+            return response
+
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "derivative.sock")
+                async with await server.serve(path, service=service):
+                    return await asyncio.gather(*(client(path, job) for job in jobs))
+
+        return asyncio.run(run())
+
+    def test_concurrent_symbolic_jobs_are_coalesced(self):
+        service = server.Service(ThreadPoolExecutor(4))
+        jobs = [{"id": i, "expr": "tan(x) * sin(x)" if i % 2 else "tan(x)*sin(x)", "op": "derivative", "order": 3}
+                for i in range(10)]
+        responses = self.ask(jobs, service)
+        self.assertEqual([r["id"] for r in responses], list(range(10)))
+        self.assertEqual({r["result"] for r in responses}, {repr(nth_derivative(Multiply(Tan(X()), Sin(X())), 3))})
+        self.assertEqual(service.computations, 1)
+
+    def test_evaluations_are_batched(self):
+        service = server.Service(ThreadPoolExecutor(4), batch_window=0.05)
+        jobs = [{"id": i, "expr": "a * x^2", "op": "evaluate", "points": [i, i + 0.5], "variables": {"a": 3}}
+                for i in range(8)]
+        jobs.append({"id": "scalar", "expr": "a * x^2", "op": "evaluate", "points": 2, "variables": {"a": 3}})
+        jobs.append({"id": "bad", "expr": "a * x^2", "op": "integrate"})
+        responses = {r["id"]: r for r in self.ask(jobs, service)}
+        for i in range(8):
+            np.testing.assert_allclose(responses[i]["result"], [3 * i ** 2, 3 * (i + 0.5) ** 2])
+        self.assertEqual(responses["scalar"]["result"], 12.0)
+        self.assertIn("unknown op", responses["bad"]["error"])
+        self.assertEqual(service.computations, 1)
+
+    def test_matches_pipeline(self):
+        service = server.Service(ThreadPoolExecutor(2))
+        jobs = [{"id": 0, "expr": "(-2)^x", "op": "evaluate", "points": [2, 3]},
+                {"id": 1, "expr": "(-2)^x * a", "op": "evaluate", "points": [[2]], "variables": {"a": 1}},
+                {"id": 2, "expr": "(-2)^x", "op": "derivative"}]
+        for response, job in zip(self.ask(jobs, service), jobs):
+            self.assertEqual(response["result"], pipeline.process(job))
+        self.assertEqual(self.ask(jobs[:1], service)[0]["result"], [4.0, -8.0])
+
+class TestInstrument(unittest.TestCase):
+
+    def test_expression_stats(self):
+        shared = Sin(X())
+        stats = instrument.ExpressionStats(Add(Multiply(shared, shared), shared))
+        self.assertEqual((stats.nodes, stats.tree_size, stats.depth), (4, 8, 4))
+        self.assertEqual(stats.node_types, {"X": 1, "Sin": 1, "Multiply": 1, "Add": 1})
+        self.assertEqual(stats.shared_ratio, 0.5)
+
+    def test_profile_times_node_classes_and_restores_methods(self):
+        original = Multiply.__call__
+        with instrument.Profile() as profile:
+            expr = Multiply(Sin(X()), Ln(X())).derivative().simplify()
+            expr(0.5)
+            self.assertIsNot(Multiply.__call__, original)
+        self.assertIs(Multiply.__call__, original)
+        report = profile.as_dict()
+        self.assertEqual(report["Multiply"]["derivative"]["calls"], 1)
+        self.assertIn("simplify", report["Add"])
+        self.assertGreater(report["Sin"]["__call__"]["calls"], 0)
+        self.assertGreaterEqual(min(s for _, _, s in profile.slowest()), 0.0)
+
+class TestMultivariate(unittest.TestCase):
+
+    def setUp(self):
+        a, b = Variable("a"), Variable("b")
+        self.f = Add(Multiply(a, Sin(b)), Divide(EToTheF(Multiply(a, b)), X()))
+        self.point = {"a": 0.5, "b": 2.0, "x": 3.0}
+
+    def numeric_partial(self, expr, point, name, eps=1e-6):
+        up, down = dict(point), dict(point)
+        up[name] += eps
+        down[name] -= eps
+        return (expr.value_and_gradient(up)[0] - expr.value_and_gradient(down)[0]) / (2 * eps)
+
+    def test_gradient_in_one_sweep(self):
+        value, gradient = self.f.value_and_gradient(self.point)
+        self.assertAlmostEqual(value, 0.5 * math.sin(2.0) + math.exp(1.0) / 3.0)
+        self.assertEqual(sorted(gradient), ["a", "b", "x"])
+        for name in gradient:
+            self.assertAlmostEqual(gradient[name], self.numeric_partial(self.f, self.point, name), places=5)
+
+    def test_x_matches_symbolic_derivative(self):
+        gradient = self.f.value_and_gradient(self.point)[1]
+        self.assertAlmostEqual(gradient["x"], self.f.derivative().evaluate(3.0, a=0.5, b=2.0))
+
+    def test_array_variables_without_x(self):
+        a = Variable("a")
+        b = np.array([0.5, 1.0, 2.0])
+        expr = Multiply(a, Sin(Variable("b")))
+        value, gradient = expr.value_and_gradient({"a": 2.0, "b": b})
+        np.testing.assert_allclose(value, 2 * np.sin(b))
+        np.testing.assert_allclose(gradient["b"], 2 * np.cos(b))
+        np.testing.assert_allclose(jacobian([expr], {"a": 2.0, "b": b}, ["a"])[0, 0], np.sin(b))
+
+    def test_forward_mode_with_variables(self):
+        expr = Multiply(X(), Sin(Variable("a")))
+        self.assertEqual(expr.value_and_derivative(2.0, a=1.0), (2 * math.sin(1.0), math.sin(1.0)))
+        values, slopes = expr.value_and_derivative(2.0, a=[0.0, 1.0])
+        np.testing.assert_allclose(slopes, np.sin([0.0, 1.0]))
+        with self.assertRaises(ValueError):
+            expr.value_and_derivative(2.0)
+
+    def test_batched_jacobian(self):
+        a = np.array([0.5, 1.0, 1.5])
+        J = jacobian([self.f, Multiply(Variable("a"), Variable("a"))], {"a": a, "b": 2.0, "x": 3.0}, ["a", "b"])
+        self.assertEqual(J.shape, (2, 2, 3))
+        np.testing.assert_allclose(J[1, 0], 2 * a)
+        np.testing.assert_allclose(J[1, 1], 0.0)
+        for i, ai in enumerate(a):
+            gradient = self.f.value_and_gradient({"a": ai, "b": 2.0, "x": 3.0})[1]
+            self.assertAlmostEqual(J[0, 0, i], gradient["a"])
+
+    def test_compile_and_store(self):
+        f = self.f.compile()
+        self.assertAlmostEqual(f(3.0, a=0.5, b=2.0), self.f.value_and_gradient(self.point)[0])
+        self.assertIs(store.loads(store.dumps(self.f)), self.f)
+
+    def test_compiled_names_cannot_collide(self):
+        self.assertAlmostEqual(Add(Sin(X()), Variable("r1")).compile()(1.0, r1=2.0), math.sin(1.0) + 2.0)
+        self.assertAlmostEqual(Multiply(EToTheF(X()), Variable("exp")).compile()(1.0, exp=2.0), 2.0 * math.e)
+        with self.assertRaises(ValueError):
+            Add(X(), Variable("b")).compile()(1.0)
+        for cls in (Variable, Coefficient):
+            with self.assertRaises(ValueError):
+                cls("if")
+
+class TestCoefficients(unittest.TestCase):
+
+    def test_mutable_and_never_folded(self):
+        a = Coefficient("a", 2.0)
+        self.assertIs(Coefficient("a"), a)
+        self.assertEqual(a.value, 2.0)
+        expr = Multiply(a, Sin(X()))
+        d = expr.derivative()
+        self.assertIs(d, Multiply(a, Cos(X())))
+        f = expr.compile()
+        a.value = 3.0
+        self.assertAlmostEqual(d(0.5), 3.0 * math.cos(0.5))
+        self.assertAlmostEqual(f(0.5), 3.0 * math.sin(0.5))
+        np.testing.assert_allclose(expr.evaluate([0.5, 1.0]), 3.0 * np.sin([0.5, 1.0]))
+        self.assertIs(Add(a, Constant(0)).simplify(), a)
+
+    def test_gradient_and_store(self):
+        a = Coefficient("a", 1.5)
+        expr = Multiply(a, EToTheF(Multiply(a, X())))
+        value, gradient = expr.value_and_gradient({"x": 0.4})
+        self.assertAlmostEqual(gradient["a"], (1 + 1.5 * 0.4) * math.exp(1.5 * 0.4))
+        self.assertAlmostEqual(gradient["x"], expr.derivative()(0.4))
+        data, key = store.dumps(expr), store.structural_hash(expr)
+        a.value = 0.0
+        self.assertIs(store.loads(data), expr)
+        self.assertEqual(a.value, 0.0) # the live coefficient keeps its value
+        self.assertEqual(store.structural_hash(expr), key)
+        data = store.dumps(Coefficient("fresh", 4.0)) # a coefficient this process doesn't have yet
+        gc.collect()
+        self.assertEqual(store.loads(data).value, 4.0)
+
+    def test_composite_reading_a_coefficient_isnt_folded(self):
+        c = Coefficient("c", 3.0)
+        inner = Composite(Multiply(c, X()), Constant(2))
+        d = Multiply(inner, X()).derivative()
+        self.assertEqual(d(0.0), 6.0)
+        Scaled = Composite.fromFunctional(Multiply(c, X()), "Scaled")
+        folded = fold(Add(Scaled(Constant(2)), X()))
+        c.value = 10.0
+        self.assertEqual(d(0.0), 20.0)
+        self.assertEqual(folded(0.0), 20.0)
+
+    def test_sweep_recomputes_only_the_path(self):
+        a = Coefficient("a", 1.0)
+        expr = Multiply(a, X())
+        for i in range(1, 200):
+            expr = Add(expr, Multiply(Constant(i), Sin(Add(X(), Constant(i)))))
+        sweep = expr.incremental(0.3)
+        self.assertAlmostEqual(sweep.value(), expr(0.3))
+        for k in np.linspace(-2.0, 2.0, 5):
+            sweep.update(a=k)
+            self.assertAlmostEqual(sweep.value(), expr(0.3))
+        # a, a * x and the chain of 199 Adds above it, per change
+        self.assertEqual(sweep.recomputed, 5 * 201)
+        self.assertLess(201, len(sweep.program) / 4)
+
+    def test_unchanged_values_stop_propagating(self):
+        a = Coefficient("a", 0.0)
+        expr = Add(Multiply(Multiply(a, Constant(0.0)), X()), Sin(X()))
+        xs = np.linspace(0.0, 1.0, 4)
+        sweep = expr.incremental(xs)
+        a.value = 5.0
+        np.testing.assert_allclose(sweep.value(), np.sin(xs))
+        sweep = expr.incremental(0.5)
+        a.value = 7.0
+        self.assertAlmostEqual(sweep.value(), math.sin(0.5))
+        self.assertEqual(sweep.recomputed, 2) # a, then a * 0 comes out 0 again
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,155 @@
+"""Mini-batch training for nn models, with SGD, momentum and Adam optimizers.
+
+    model = Linear(Tensor(np.zeros((8, 1))), Tensor(np.zeros(1)))
+    trainer = Trainer(model, Adam(model.parameters(), lr=0.01), batch_size=256)
+    history = trainer.fit(x, y, epochs=5)   # one dict per optimizer step
+    print(history[-1])                      # {"step": ..., "loss": ..., "samples_per_s": ...}
+
+Each batch is one vectorized forward and backward pass over a Tensor graph. The graph
+is built once per batch shape and reused: the next batch is copied into its input
+Tensors and recompute() refreshes the values, so a step creates no new graph nodes.
+Optimizers update the parameters' arrays in place.
+"""
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from nn import Parameter, Tensor, Linear, MSELoss
+
+
+def _subtract(parameter, delta) -> None:
+    # in place for Tensor arrays; a scalar Parameter's float can only be replaced
+    if isinstance(parameter.value, np.ndarray):
+        parameter.value -= delta
+    else:
+        parameter.value = parameter.value - float(delta)
+
+
+class Optimizer(ABC):
+
+    def __init__(self, parameters, lr: float) -> None:
+        self.parameters = list(parameters)
+        self.lr = lr
+
+    def zero_grad(self) -> None:
+        for p in self.parameters:
+            p.zero_grad()
+
+    @abstractmethod
+    def step(self) -> None:
+        """Update every parameter in place from its gradient."""
+
+
+class SGD(Optimizer):
+
+    def step(self) -> None:
+        for p in self.parameters:
+            _subtract(p, self.lr * p._grad)
+
+
+class Momentum(Optimizer):
+    """SGD with a velocity: v = momentum * v + grad, then value -= lr * v."""
+
+    def __init__(self, parameters, lr: float, momentum: float = 0.9) -> None:
+        super().__init__(parameters, lr)
+        self.momentum = momentum
+        self.velocity = [np.zeros_like(np.asarray(p.value, dtype=float)) for p in self.parameters]
+
+    def step(self) -> None:
+        for p, v in zip(self.parameters, self.velocity):
+            v *= self.momentum
+            v += p._grad
+            _subtract(p, self.lr * v)
+
+
+class Adam(Optimizer):
+
+    def __init__(self, parameters, lr: float = 0.001, betas: tuple = (0.9, 0.999), eps: float = 1e-8) -> None:
+        super().__init__(parameters, lr)
+        self.betas = betas
+        self.eps = eps
+        self.t = 0
+        self.m = [np.zeros_like(np.asarray(p.value, dtype=float)) for p in self.parameters]
+        self.v = [np.zeros_like(np.asarray(p.value, dtype=float)) for p in self.parameters]
+
+    def step(self) -> None:
+        b1, b2 = self.betas
+        self.t += 1
+        # bias corrections folded into the step size
+        lr = self.lr * np.sqrt(1 - b2 ** self.t) / (1 - b1 ** self.t)
+        for p, m, v in zip(self.parameters, self.m, self.v):
+            g = p._grad
+            m *= b1
+            m += (1 - b1) * g
+            v *= b2
+            v += (1 - b2) * g * g
+            _subtract(p, lr * m / (np.sqrt(v) + self.eps))
+
+
+class Trainer:
+    """Fits model (a callable taking and returning Tensors) by minimizing loss(model, y)(x).
+
+    With accumulate=n the gradients of n batches are averaged before each optimizer
+    step, so a step sees batch_size * n samples without holding them all at once.
+    Targets are reshaped to the model's output shape, so a 1-D y fits a model
+    returning (batch, 1); a y with a different number of values per sample is an error.
+    """
+
+    def __init__(self, model, optimizer: Optimizer, loss=MSELoss, batch_size: int = 256,
+                 accumulate: int = 1) -> None:
+        self.model = model
+        self.optimizer = optimizer
+        self.loss = loss
+        self.batch_size = batch_size
+        self.accumulate = accumulate
+        self.steps = 0
+        # (x batch shape, y batch shape) -> (x, y, loss, every node but the parameters)
+        self._graphs = {}
+
+    def _graph(self, x_shape: tuple, y_shape: tuple):
+        key = (x_shape, y_shape)
+        if key not in self._graphs:
+            x = Tensor(np.zeros(x_shape))
+            shape = self.model(x).shape
+            if int(np.prod(shape)) != int(np.prod(y_shape)):
+                raise ValueError(f"targets of shape {y_shape} don't fit model output of shape {shape}")
+            y = Tensor(np.zeros(shape))
+            loss = self.loss(self.model, y)(x)
+            parameters = {id(p) for p in self.optimizer.parameters}
+            others = [node for node in loss.topological_order() if id(node) not in parameters]
+            self._graphs[key] = (x, y, loss, others)
+        return self._graphs[key]
+
+    def _batch_loss(self, x_data: np.ndarray, y_data: np.ndarray, batch: np.ndarray, share: float) -> float:
+        # forward and backward for one batch, adding share of its gradient into the parameters'
+        y_shape = (len(batch),) + y_data.shape[1:]
+        x, y, loss, others = self._graph((len(batch),) + x_data.shape[1:], y_shape)
+        np.take(x_data, batch, axis=0, out=x.value)
+        np.take(y_data, batch, axis=0, out=y.value.reshape(y_shape)) # a view of y's buffer
+        loss.recompute()
+        for node in others: # the parameters accumulate across the batches of a step; nothing else does
+            node.zero_grad()
+        loss.backward(share)
+        return float(loss.value)
+
+    def fit(self, x, y, epochs: int = 1, shuffle: bool = True, seed: int = None) -> list:
+        """Train for epochs passes over (x, y); returns one stats dict per optimizer step."""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        rng = np.random.default_rng(seed)
+        history = []
+        for _ in range(epochs):
+            order = rng.permutation(len(x)) if shuffle else np.arange(len(x))
+            batches = [order[i:i + self.batch_size] for i in range(0, len(x), self.batch_size)]
+            for i in range(0, len(batches), self.accumulate):
+                group = batches[i:i + self.accumulate]
+                start = time.perf_counter()
+                self.optimizer.zero_grad()
+                losses = [self._batch_loss(x, y, batch, 1.0 / len(group)) for batch in group]
+                self.optimizer.step()
+                seconds = time.perf_counter() - start
+                self.steps += 1
+                samples = sum(len(batch) for batch in group)
+                history.append({"step": self.steps, "loss": float(np.mean(losses)), "samples": samples,
+                                "seconds": seconds, "samples_per_s": samples / seconds if seconds else float("inf")})
+        return history